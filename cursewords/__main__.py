@@ -1,3 +1,5 @@
+import sys
+
 import cursewords
 
-cursewords.main()
+sys.exit(cursewords.main())
@@ -18,3 +18,7 @@ lhblock = "▌"
 rhblock = "▐"
 fullblock = "█"
 squareblock = rhblock + fullblock + lhblock
+
+middot = "·"
+mediumshade = "▒"
+shadeblock = mediumshade * 2
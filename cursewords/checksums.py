@@ -0,0 +1,261 @@
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+
+ACROSSDOWN = b'ACROSS&DOWN\0'
+MASKSTRING = b'ICHEATED'
+
+# Offsets from the start of the header, which begins two bytes before
+# the ACROSS&DOWN magic string.
+GLOBAL_OFFSET = 0
+CIB_OFFSET = 14
+MASKED_OFFSET = 16
+VERSION_OFFSET = 24
+CIB_START = 44
+HEADER_SIZE = 52
+
+EXTENSION_HEADER_FORMAT = '<4sHH'
+
+
+def data_cksum(data, cksum=0):
+    for b in data:
+        cksum = ((cksum >> 1) | ((cksum & 1) << 15)) + b & 0xffff
+    return cksum
+
+
+def data_cksums(data, length):
+    """Return the checksum of each length-byte piece of data, in order.
+
+    The pieces are checksummed together: each gets a 16-bit lane of one
+    big integer, so a step of the loop costs a few operations on that
+    integer instead of one step per piece.
+    """
+    count = len(data) // length
+    ones = int.from_bytes(b'\x01\x00' * count, 'little')
+    low, high = ones * 0x7fff, ones * 0x8000
+
+    lanes = bytearray(2 * count)
+    cksum = 0
+    for i in range(length):
+        lanes[0::2] = data[i::length]
+        # Rotate each lane right by one, then add the byte to it without
+        # carrying into the next lane.
+        cksum = ((cksum >> 1) & low) | ((cksum & ones) << 15)
+        cksum = ((cksum & low) + int.from_bytes(lanes, 'little')) ^ (
+                cksum & high)
+    return list(struct.unpack('<{}H'.format(count),
+                              cksum.to_bytes(2 * count, 'little')))
+
+
+class Sections:
+    """Locations of the checksummed sections of a .puz file."""
+    def __init__(self, data):
+        start = data.find(ACROSSDOWN)
+        if start < 2:
+            raise ValueError("no puzzle header found")
+        self.base = base = start - 2
+        if len(data) < base + HEADER_SIZE:
+            raise ValueError("truncated header")
+
+        width, height, clue_count = struct.unpack_from(
+                '<BBH', data, base + CIB_START)
+        self.version = bytes(data[base + VERSION_OFFSET:
+                                  base + VERSION_OFFSET + 3])
+        self.cib = (base + CIB_START, base + HEADER_SIZE)
+
+        size = width * height
+        self.solution = (base + HEADER_SIZE, base + HEADER_SIZE + size)
+        self.fill = (self.solution[1], self.solution[1] + size)
+        if self.fill[1] > len(data):
+            raise ValueError("truncated grid")
+
+        pos = self.fill[1]
+        strings = []
+        for _ in range(3 + clue_count + 1):
+            end = data.find(b'\0', pos)
+            if end < 0:
+                raise ValueError("truncated strings")
+            strings.append((pos, end))
+            pos = end + 1
+        self.title, self.author, self.copyright = strings[:3]
+        self.clues = strings[3:-1]
+        self.notes = strings[-1]
+
+        self.extensions = []
+        header_size = struct.calcsize(EXTENSION_HEADER_FORMAT)
+        while pos + header_size <= len(data):
+            code, length, _ = struct.unpack_from(EXTENSION_HEADER_FORMAT,
+                                                 data, pos)
+            start = pos + header_size
+            if start + length > len(data):
+                break
+            self.extensions.append((code, pos + 6, (start, start + length)))
+            pos = start + length + 1
+
+    def text_cksum(self, data, cksum=0):
+        for start, end in (self.title, self.author, self.copyright):
+            if end > start:
+                cksum = data_cksum(data[start:end + 1], cksum)
+        for start, end in self.clues:
+            if end > start:
+                cksum = data_cksum(data[start:end], cksum)
+        start, end = self.notes
+        if self.version == b'1.3' and end > start:
+            cksum = data_cksum(data[start:end + 1], cksum)
+        return cksum
+
+    def expected(self, data):
+        """Return {section name: (offset, format, correct value)}."""
+        cib = data_cksum(data[slice(*self.cib)])
+        solution = data_cksum(data[slice(*self.solution)])
+        fill = data_cksum(data[slice(*self.fill)])
+        text = self.text_cksum(data)
+
+        global_cksum = data_cksum(data[slice(*self.solution)], cib)
+        global_cksum = data_cksum(data[slice(*self.fill)], global_cksum)
+        global_cksum = self.text_cksum(data, global_cksum)
+
+        masked = bytearray(8)
+        for i, cksum in enumerate([cib, solution, fill, text]):
+            masked[i] = MASKSTRING[i] ^ (cksum & 0xff)
+            masked[i + 4] = MASKSTRING[i + 4] ^ (cksum >> 8)
+
+        sections = {
+            'global': (self.base + GLOBAL_OFFSET, '<H', global_cksum),
+            'cib': (self.base + CIB_OFFSET, '<H', cib),
+            'masked': (self.base + MASKED_OFFSET, '<Q',
+                       struct.unpack('<Q', masked)[0]),
+        }
+        for code, offset, region in self.extensions:
+            name = code.decode('latin-1')
+            sections[name] = (offset, '<H', data_cksum(data[slice(*region)]))
+        return sections
+
+
+def check_file(path, repair=False):
+    """Return (path, bad section names, error message, repaired)."""
+    try:
+        with open(path, 'r+b' if repair else 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return path, [], "empty file", False
+            access = mmap.ACCESS_WRITE if repair else mmap.ACCESS_READ
+            with mmap.mmap(f.fileno(), 0, access=access) as data:
+                sections = Sections(data)
+                bad = []
+                for name, (offset, fmt, value) in \
+                        sections.expected(data).items():
+                    if struct.unpack_from(fmt, data, offset)[0] != value:
+                        bad.append(name)
+                        if repair:
+                            struct.pack_into(fmt, data, offset, value)
+                if repair and bad:
+                    data.flush()
+                return path, bad, None, repair and bool(bad)
+    except (OSError, ValueError, struct.error) as e:
+        return path, [], str(e), False
+
+
+def patch_puzzle(path, solution, fill, extensions):
+    """Write a new fill and extension data over a .puz file in place.
+
+    Only the bytes that changed are written, then the checksums that
+    cover them. Returns False, without writing anything, unless the file
+    holds the same solution and every extension already, at the same
+    sizes; the caller should then rewrite the whole file.
+    """
+    try:
+        with open(path, 'r+b') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE) as data:
+                sections = Sections(data)
+                if data[slice(*sections.solution)] != solution:
+                    return False
+                regions = {code: region
+                           for code, _, region in sections.extensions}
+                if set(regions) != set(extensions):
+                    return False
+                changes = [(sections.fill, fill)] + [
+                        (regions[code], value)
+                        for code, value in extensions.items()]
+                if any(end - start != len(value)
+                       for (start, end), value in changes):
+                    return False
+
+                for (start, end), value in changes:
+                    changed = [i for i, (old, new) in
+                               enumerate(zip(data[start:end], value))
+                               if old != new]
+                    if changed:
+                        first, last = changed[0], changed[-1] + 1
+                        data[start + first:start + last] = value[first:last]
+
+                for offset, fmt, value in sections.expected(data).values():
+                    if struct.unpack_from(fmt, data, offset)[0] != value:
+                        struct.pack_into(fmt, data, offset, value)
+                data.flush()
+                return True
+    except (OSError, ValueError, struct.error):
+        return False
+
+
+def check_file_repairing(path):
+    return check_file(path, repair=True)
+
+
+def find_puzzles(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.puz'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            prog='cursewords verify',
+            description="""Checks the checksums of .puz files, and
+                           optionally rewrites the ones that are wrong.""")
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+            help="""puzzle files, or directories to search for them""")
+    parser.add_argument('--repair', action='store_true',
+            help="""rewrite bad checksums in place""")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help="""number of worker processes (default: one per CPU)""")
+    parser.add_argument('-v', '--verbose', action='store_true',
+            help="""also list files that are fine""")
+
+    args = parser.parse_args(argv)
+
+    worker = check_file_repairing if args.repair else check_file
+    counts = {'ok': 0, 'bad': 0, 'repaired': 0, 'unreadable': 0}
+
+    with multiprocessing.Pool(args.jobs) as pool:
+        results = pool.imap_unordered(worker, find_puzzles(args.paths),
+                                      chunksize=64)
+        for path, bad, error, repaired in results:
+            if error:
+                counts['unreadable'] += 1
+                print("{}: unreadable ({})".format(path, error))
+            elif bad:
+                counts['repaired' if repaired else 'bad'] += 1
+                print("{}: {} {}".format(
+                    path, "repaired" if repaired else "bad",
+                    ', '.join(bad)))
+            else:
+                counts['ok'] += 1
+                if args.verbose:
+                    print("{}: ok".format(path))
+
+    print("{ok} ok, {bad} bad, {repaired} repaired, "
+          "{unreadable} unreadable.".format(**counts), file=sys.stderr)
+
+    return 1 if counts['bad'] or counts['unreadable'] else 0
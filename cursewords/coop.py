@@ -0,0 +1,270 @@
+import asyncio
+import base64
+import json
+import socket
+import sys
+
+import puz
+
+# How often queued deltas are written out. Changes and cursor moves that
+# arrive within one interval go out to each peer as a single message.
+FLUSH_INTERVAL = 0.02
+
+# If a peer's unsent output grows past this many bytes it is skipped on
+# flush. Its pending deltas keep coalescing per cell until it catches up,
+# so a slow client costs at most one entry per cell instead of an
+# unbounded backlog.
+HIGH_WATER = 64 * 1024
+
+DEFAULT_ADDRESS = '127.0.0.1:7817'
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+def parse_address(address):
+    if address.startswith('unix:'):
+        return None, address[len('unix:'):]
+    if '/' in address:
+        return None, address
+    host, _, port = address.rpartition(':')
+    return (host or '127.0.0.1', int(port)), None
+
+
+class Peer:
+    """One end of a co-op connection.
+
+    Outgoing cell changes are held in a dict keyed by cell index and
+    cursor positions in a dict keyed by player id, so repeated edits to
+    the same cell collapse into one entry until the next flush.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.cells = {}
+        self.cursors = {}
+        self.extra = {}
+        self.position = None
+        self.closed = False
+
+    def queue_cells(self, changes):
+        for change in changes:
+            self.cells[change[0]] = change
+
+    def queue_cursor(self, player, cursor):
+        self.cursors[str(player)] = cursor
+
+    def queue(self, **message):
+        self.extra.update(message)
+
+    def flush(self):
+        if self.closed or not (self.cells or self.cursors or self.extra):
+            return
+        if self.writer.transport.get_write_buffer_size() > HIGH_WATER:
+            return
+
+        message = dict(self.extra)
+        if self.cells:
+            message['c'] = list(self.cells.values())
+        if self.cursors:
+            message['p'] = self.cursors
+        self.writer.write(encode(message))
+
+        self.cells = {}
+        self.cursors = {}
+        self.extra = {}
+
+    async def flush_forever(self):
+        while not self.closed:
+            self.flush()
+            await asyncio.sleep(FLUSH_INTERVAL)
+
+    async def messages(self):
+        while True:
+            try:
+                line = await self.reader.readline()
+            except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+                break
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(message, dict):
+                yield message
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
+
+
+class Server:
+    """Owns the authoritative grid for a co-op solve.
+
+    Clients send the cells they changed and their cursor position; the
+    server applies valid changes to its grid and relays them to every
+    other client.
+    """
+    def __init__(self, grid, filename):
+        self.grid = grid
+        self.filename = filename
+        # Changes name cells by their index in this list.
+        self.cells = list(grid.cells.values())
+        self.peers = {}
+        self.next_id = 1
+
+    def hello(self, player):
+        self.grid.update_puzfile()
+        puz_bytes = self.grid.puzfile.tobytes()
+        cursors = {str(other): peer.position
+                   for other, peer in self.peers.items()
+                   if peer.position}
+        return {'h': {'id': player,
+                      'puz': base64.b64encode(puz_bytes).decode()},
+                'p': cursors}
+
+    def apply(self, changes):
+        applied = []
+        if not isinstance(changes, list):
+            return applied
+        for change in changes:
+            try:
+                idx, entry, md = change
+            except (TypeError, ValueError):
+                continue
+            if not (type(idx) is int and 0 <= idx < len(self.cells)):
+                continue
+            cell = self.cells[idx]
+            if (not cell.is_letter() or not isinstance(entry, str)
+                    or not isinstance(md, int)
+                    or not (entry == '-' or
+                            (len(entry) == 1 and entry.isalnum()))):
+                continue
+            cell.entry = entry
+            cell.set_markup(md)
+            applied.append([idx, entry, md])
+        return applied
+
+    def broadcast(self, sender, changes=None, cursor=None):
+        for player, peer in self.peers.items():
+            if player == sender:
+                continue
+            if changes:
+                peer.queue_cells(changes)
+            if cursor is not None:
+                peer.queue_cursor(sender, cursor)
+
+    async def handle(self, reader, writer):
+        player = self.next_id
+        self.next_id += 1
+
+        peer = Peer(reader, writer)
+        writer.write(encode(self.hello(player)))
+        self.peers[player] = peer
+        log("Player {} joined ({} connected).".format(player,
+                                                      len(self.peers)))
+
+        try:
+            async for message in peer.messages():
+                changes = self.apply(message.get('c', []))
+                cursor = message.get('p')
+                if (isinstance(cursor, list) and len(cursor) == 3
+                        and all(isinstance(n, int) for n in cursor[:2])):
+                    peer.position = cursor
+                else:
+                    cursor = None
+                self.broadcast(player, changes, cursor)
+
+                if message.get('s'):
+                    self.grid.update_puzfile()
+                    self.grid.save_puzfile(self.filename)
+                    log("Player {} saved {}.".format(player, self.filename))
+        finally:
+            del self.peers[player]
+            peer.closed = True
+            writer.close()
+            # Tell everybody else to drop this player's cursor.
+            self.broadcast(player, cursor=False)
+            log("Player {} left ({} connected).".format(player,
+                                                        len(self.peers)))
+
+    async def flush_forever(self):
+        while True:
+            for peer in list(self.peers.values()):
+                peer.flush()
+            await asyncio.sleep(FLUSH_INTERVAL)
+
+    async def serve(self, address):
+        inet, path = parse_address(address)
+        if path:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, *inet)
+
+        log("Serving {} on {}.".format(self.filename, address))
+        flusher = asyncio.ensure_future(self.flush_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flusher.cancel()
+
+
+class Client(Peer):
+    """A Session's connection to a co-op server.
+
+    The greeting is read with a plain blocking socket before the event
+    loop starts, since the puzzle it carries is needed to lay out the
+    screen; connect() hands the socket over to asyncio afterwards.
+    """
+    def __init__(self, sock, player, cursors):
+        super().__init__(None, None)
+        self.sock = sock
+        self.player = player
+        self.cursors_at_join = cursors
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(
+                sock=self.sock)
+
+    async def listen(self, session):
+        async for message in self.messages():
+            session.post(session.apply_remote, message)
+        if not self.closed:
+            self.closed = True
+            session.post(session.disconnected)
+
+
+def join(address):
+    inet, path = parse_address(address)
+    if path:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    else:
+        sock = socket.create_connection(inet)
+
+    # Read exactly one line, leaving anything after it on the socket
+    # for the asyncio reader.
+    line = b''
+    while not line.endswith(b'\n'):
+        chunk = sock.recv(65536, socket.MSG_PEEK)
+        if not chunk:
+            break
+        newline = chunk.find(b'\n')
+        line += sock.recv(newline + 1 if newline >= 0 else len(chunk))
+
+    try:
+        hello = json.loads(line)
+        puzfile = puz.load(base64.b64decode(hello['h']['puz']))
+    except (ValueError, KeyError, TypeError, puz.PuzzleFormatError):
+        sock.close()
+        raise ConnectionError("unexpected greeting from co-op server")
+
+    client = Client(sock, hello['h']['id'], hello.get('p', {}))
+    return client, puzfile
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
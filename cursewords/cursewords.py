@@ -1,22 +1,58 @@
 #! /usr/bin/env python3
 
 import argparse
+import asyncio
+import collections
 import itertools
 import os
+import re
 import sys
 import time
 import textwrap
-import threading
 
 import puz
 
 from blessed import Terminal
+from blessed.keyboard import Keystroke
 
 from . import chars
+from . import checksums
+from . import coop
+from . import export
+from . import history
+from . import keymap
+from . import pack
+from . import recording
+from . import search
+from . import solver
+from . import unlock
+from . import wordlist
+
+WORD_RUN = re.compile(r"[^\W_]{2,}")
+BLOCK_OR_LETTER = re.compile(r"(?:[^\W_]|\.)*")
+BLOCK = re.compile(r"\.")
+
+CellChange = collections.namedtuple(
+        'CellChange',
+        ['position', 'index', 'entry', 'markup', 'old_entry', 'old_markup'])
+
+# The progress on a puzzle whose tab has been evicted from the cache.
+Snapshot = collections.namedtuple(
+        'Snapshot',
+        ['fill', 'markup', 'timer', 'position', 'direction', 'modified'])
 
 
 class Cell:
+    __slots__ = ['solution', 'number', 'entry', 'marked_wrong', 'corrected',
+                 'revealed', 'circled', 'bus', 'index']
+
+    # Assigning any of these reports the change to the cell's bus.
+    WATCHED = frozenset(['entry', 'marked_wrong', 'corrected', 'revealed'])
+
     def __init__(self, solution, entry=None):
+        # __setattr__ looks at the bus, so it has to be there first.
+        object.__setattr__(self, 'bus', None)
+        self.index = None
         self.solution = solution
 
         self.number = None
@@ -33,6 +69,11 @@ class Cell:
     def __str__(self):
         return self.entry
 
+    def __setattr__(self, name, value):
+        if self.bus and name in self.WATCHED:
+            self.bus.changing(self)
+        object.__setattr__(self, name, value)
+
     def clear(self):
         self.entry = "-"
         if self.marked_wrong:
@@ -54,93 +95,192 @@ class Cell:
     def is_correct(self):
         return self.entry == self.solution or self.is_block()
 
+    def get_markup(self):
+        md = 0
+        if self.corrected:
+            md += 16
+        if self.marked_wrong:
+            md += 32
+        if self.revealed:
+            md += 64
+        if self.circled:
+            md += 128
+        return md
+
+    def set_markup(self, md):
+        self.corrected = bool(md & 16)
+        self.marked_wrong = bool(md & 32)
+        self.revealed = bool(md & 64)
+        self.circled = bool(md & 128)
+
+
+class ChangeBus:
+    """Collects cell changes and passes them to subscribers in batches."""
+    # Subscribers get one CellChange per cell whose state differs from
+    # before its first change, and where the changes came from ('local',
+    # 'remote', 'history' or 'replay').
+    def __init__(self, column_count):
+        self.column_count = column_count
+        self.pending = {}
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def changing(self, cell):
+        if cell.index not in self.pending:
+            self.pending[cell.index] = (cell, cell.entry, cell.get_markup())
+
+    def flush(self, origin='local'):
+        changes = []
+        for idx, (cell, old_entry, old_markup) in sorted(
+                self.pending.items()):
+            markup = cell.get_markup()
+            if (cell.entry, markup) != (old_entry, old_markup):
+                row, col = divmod(idx, self.column_count)
+                changes.append(CellChange((col, row), idx, cell.entry,
+                                          markup, old_entry, old_markup))
+        self.pending = {}
+
+        if changes:
+            for callback in self.subscribers:
+                callback(changes, origin)
+        return changes
+
 
 class Grid:
-    def __init__(self, grid_x, grid_y, term):
+    def __init__(self, grid_x, grid_y, term, compact=False):
         self.grid_x = grid_x
         self.grid_y = grid_y
         self.term = term
 
-        self.notification_area = (term.height-2, self.grid_x)
+        # The compact layout gives each square two columns and one row,
+        # with no borders between squares and no numbers in them.
+        self.compact = compact
+        self.cell_width, self.cell_height = (2, 1) if compact else (4, 2)
+        self.session = None
+        self.notification_timer = None
+        self.bus = None
+
+        # The key a scrambled puzzle was unlocked with, so it can be
+        # scrambled again when it's saved.
+        self.lock_key = None
+
+        # A grid without a terminal (e.g. the one owned by a co-op
+        # server) can be loaded and edited but never drawn.
+        if term:
+            self.notification_area = (term.height-2, self.grid_x)
 
     def load(self, puzfile):
         self.puzfile = puzfile
-        self.cells = {}
         self.row_count = puzfile.height
         self.column_count = puzfile.width
 
         self.title = puzfile.title
         self.author = puzfile.author
 
-        for i in range(self.row_count):
-            for j in range(self.column_count):
-                idx = i * self.column_count + j
-                entry = self.puzfile.fill[idx]
-                self.cells[(j, i)] = Cell(
-                        self.puzfile.solution[idx],
-                        entry)
-
+        width = self.column_count
+        solution, fill = puzfile.solution, puzfile.fill
+        positions = [(j, i) for i in range(self.row_count)
+                     for j in range(width)]
+        cells = [Cell(solution[idx], fill[idx])
+                 for idx in range(len(positions))]
+        self.cells = dict(zip(positions, cells))
+
+        # Words are runs of two or more letter squares, found with a
+        # regex over each row of the solution and each column (a strided
+        # slice of it) rather than square by square.
         self.across_words = []
         for i in range(self.row_count):
-            current_word = []
-            for j in range(self.column_count):
-                if self.cells[(j, i)].is_letter():
-                    current_word.append((j, i))
-                elif len(current_word) > 1:
-                    self.across_words.append(current_word)
-                    current_word = []
-                elif current_word:
-                    current_word = []
-            if len(current_word) > 1:
-                self.across_words.append(current_word)
+            row_start = i * width
+            for run in WORD_RUN.finditer(solution, row_start,
+                                         row_start + width):
+                self.across_words.append(positions[run.start():run.end()])
 
         self.down_words = []
-        for j in range(self.column_count):
-            current_word = []
-            for i in range(self.row_count):
-                if self.cells[(j, i)].is_letter():
-                    current_word.append((j, i))
-                elif len(current_word) > 1:
-                    self.down_words.append(current_word)
-                    current_word = []
-                elif current_word:
-                    current_word = []
-            if len(current_word) > 1:
-                self.down_words.append(current_word)
+        for j in range(width):
+            column = positions[j::width]
+            for run in WORD_RUN.finditer(solution[j::width]):
+                self.down_words.append(column[run.start():run.end()])
 
         self.down_words_grouped = sorted(self.down_words,
                 key=lambda word: (word[0][1], word[0][0]))
 
-        num = self.puzfile.clue_numbering()
-        self.across_clues = [word['clue'] for word in num.across]
-        self.down_clues = [word['clue'] for word in num.down]
+        # puzpy numbers the grid from the fill and only counts '.' as a
+        # block. When that agrees with the words above, the clues can be
+        # dealt out without building its numbering.
+        if (BLOCK_OR_LETTER.fullmatch(solution) and
+                [m.start() for m in BLOCK.finditer(solution)] ==
+                [m.start() for m in BLOCK.finditer(fill)]):
+            self.across_clues, self.down_clues = self.assign_clues()
+        else:
+            num = self.puzfile.clue_numbering()
+            self.across_clues = [word['clue'] for word in num.across]
+            self.down_clues = [word['clue'] for word in num.down]
 
         if self.puzfile.has_markup():
             markup = self.puzfile.markup().markup
 
-            for md, pos in zip(markup, self.cells):
-                cell = self.cells.get(pos)
-                if md >= 128:
-                    cell.circled = True
-                    md -= 128
-                if md >= 64:
-                    cell.revealed = True
-                    md -= 64
-                if md >= 32:
-                    cell.marked_wrong = True
-                    md -= 32
-                if md == 16:
-                    cell.corrected = True
-
-        timer_bytes = self.puzfile.extensions.get(puz.Extensions.Timer, None)
+            for cell, md in zip(cells, markup):
+                cell.set_markup(md)
+
+        self.watch(cells)
+        self.read_timer(puzfile)
+
+        return None
+
+    def share(self, template, progress=None):
+        """Load the puzzle already loaded into another grid."""
+        # Only the squares are this grid's own; their entries and markup
+        # come from progress, a saved copy of the puzzle, if given.
+        for name in ('puzfile', 'row_count', 'column_count', 'title',
+                     'author', 'across_words', 'down_words',
+                     'down_words_grouped', 'across_clues', 'down_clues',
+                     'lock_key'):
+            setattr(self, name, getattr(template, name))
+
+        cells = []
+        for square in template.cells.values():
+            cell = Cell(square.solution, square.entry)
+            cell.set_markup(square.get_markup())
+            cell.number = square.number
+            cells.append(cell)
+
+        source = template.puzfile
+        if progress:
+            source = progress
+            markup = (progress.markup().markup if progress.has_markup()
+                      else [0] * len(cells))
+            for cell, entry, md in zip(cells, progress.fill, markup):
+                if cell.is_letter():
+                    cell.entry = entry
+                    cell.set_markup(md | cell.get_markup() & 128)
+
+        self.cells = dict(zip(template.cells, cells))
+        self.watch(cells)
+        self.read_timer(source)
+
+    def watch(self, cells):
+        # Only watch the cells once they're loaded.
+        self.bus = ChangeBus(self.column_count)
+        for idx, cell in enumerate(cells):
+            cell.index = idx
+            cell.bus = self.bus
+
+    def read_timer(self, puzfile):
+        timer_bytes = puzfile.extensions.get(puz.Extensions.Timer, None)
         if timer_bytes:
             self.start_time, self.timer_active = timer_bytes.decode().split(',')
         else:
             self.start_time, self.timer_active = 0, 1
 
-        return None
-
     def draw(self):
+        if self.compact:
+            empty_row = self.term.dim(chars.middot + ' ') * self.column_count
+            for y_val in range(self.grid_y, self.grid_y + self.row_count):
+                print(self.term.move(y_val, self.grid_x) + empty_row)
+            return None
+
         top_row = self.get_top_row()
         bottom_row = self.get_bottom_row()
         middle_row = self.get_middle_row()
@@ -163,18 +303,27 @@ class Grid:
 
         return None
 
-    def number(self):
-        numbered_squares = []
-        for word in self.across_words:
-            numbered_squares.append(word[0])
+    def assign_clues(self):
+        clues = iter(self.puzfile.clues)
+        across_starts = {word[0] for word in self.across_words}
+        down_starts = {word[0] for word in self.down_words}
 
-        for word in self.down_words:
-            if word[0] not in numbered_squares:
-                numbered_squares.append(word[0])
+        across_clues, down_clues = [], []
+        for square in sorted(across_starts | down_starts,
+                             key=lambda x: (x[1], x[0])):
+            if square in across_starts:
+                across_clues.append(next(clues))
+            if square in down_starts:
+                down_clues.append(next(clues))
+        return across_clues, down_clues
 
-        numbered_squares.sort(key=lambda x: (x[1], x[0]))
+    def number(self):
+        numbered_squares = {word[0] for word in self.across_words}
+        numbered_squares.update(word[0] for word in self.down_words)
 
-        for number, square in enumerate(numbered_squares, 1):
+        for number, square in enumerate(sorted(numbered_squares,
+                                               key=lambda x: (x[1], x[0])),
+                                        1):
             self.cells.get(square).number = number
 
         return None
@@ -185,21 +334,24 @@ class Grid:
             cell = self.cells[position]
             if cell.is_letter():
                 self.draw_cell(position)
+            elif cell.is_block() and self.compact:
+                print(self.term.move(y_coord, x_coord) +
+                        self.term.dim(chars.shadeblock))
             elif cell.is_block():
                 print(self.term.move(y_coord, x_coord - 1) +
                         self.term.dim(chars.squareblock))
 
-            if cell.number:
+            if cell.number and not self.compact:
                 small = small_nums(cell.number)
                 x_pos = x_coord - 1
                 print(self.term.move(y_coord - 1, x_pos) + small)
 
         return None
 
-    def confirm_quit(self, modified_since_save):
+    async def confirm_quit(self, modified_since_save):
         confirmed = True
         if modified_since_save:
-            confirmation = self.get_notification_input(
+            confirmation = await self.get_notification_input(
                                 "Quit without saving? (y/n)",
                                 chars=1, blocking=True, timeout=5)
             if confirmation.lower() == 'y':
@@ -209,8 +361,8 @@ class Grid:
 
         return confirmed
 
-    def confirm_clear(self):
-        confirmation = self.get_notification_input("Clear puzzle? (y/n)",
+    async def confirm_clear(self):
+        confirmation = await self.get_notification_input("Clear puzzle? (y/n)",
                                 chars=1, blocking=True, timeout=5)
         if confirmation.lower() == 'y':
             confirmed = True
@@ -218,8 +370,8 @@ class Grid:
             confirmed = False
         return confirmed
 
-    def confirm_reset(self):
-        confirmation = self.get_notification_input("Reset puzzle? (y/n)",
+    async def confirm_reset(self):
+        confirmation = await self.get_notification_input("Reset puzzle? (y/n)",
                                 chars=1, blocking=True, timeout=5)
         if confirmation.lower() == 'y':
             confirmed = True
@@ -228,6 +380,43 @@ class Grid:
         return confirmed
 
     def save(self, filename):
+        self.update_puzfile()
+        self.save_puzfile(filename)
+
+        self.send_notification("Current puzzle state saved.")
+
+    def save_puzfile(self, filename):
+        # A puzzle from a pack has its progress written back into the pack.
+        if pack.is_member(filename):
+            pack.write_member(filename, self.puzfile)
+            return
+
+        if not self.lock_key:
+            self.write_puzfile(filename)
+            return
+
+        self.puzfile.lock_solution(self.lock_key)
+        try:
+            self.write_puzfile(filename)
+        finally:
+            self.puzfile.unlock_solution(self.lock_key)
+
+    def write_puzfile(self, filename):
+        # Solving only changes the fill, markup and timer, so the file on
+        # disk can usually be patched in place instead of rewritten.
+        puzfile = self.puzfile
+        for helper in puzfile.helpers.values():
+            if hasattr(helper, 'save'):
+                helper.save()
+        extensions = {code: data for code, data in puzfile.extensions.items()
+                      if data}
+        if not checksums.patch_puzzle(filename,
+                                      puzfile.solution.encode(puz.ENCODING),
+                                      puzfile.fill.encode(puz.ENCODING),
+                                      extensions):
+            puzfile.save(filename)
+
+    def update_puzfile(self):
         fill = ''
         for pos in self.cells:
             cell = self.cells[pos]
@@ -241,35 +430,18 @@ class Grid:
         self.puzfile.fill = fill
 
         if (any(self.cells.get(pos).marked_wrong or
-                self.cells.get(pos).corrected
+                self.cells.get(pos).corrected or
+                self.cells.get(pos).revealed
                 for pos in self.cells) or
                 self.puzfile.has_markup()):
-            md = []
-            for pos in self.cells:
-                cell = self.cells[pos]
-                cell_md = 0
-                if cell.corrected:
-                    cell_md += 16
-                if cell.marked_wrong:
-                    cell_md += 32
-                if cell.revealed:
-                    cell_md += 64
-                if cell.circled:
-                    cell_md += 128
-                md.append(cell_md)
-
+            md = [self.cells[pos].get_markup() for pos in self.cells]
             self.puzfile.markup().markup = md
 
-        self.puzfile.save(filename)
-
-        self.send_notification("Current puzzle state saved.")
-
     def reveal_cell(self, pos):
         cell = self.cells.get(pos)
         if cell.is_blankish() or not cell.is_correct():
             cell.entry = cell.solution
             cell.revealed = True
-            self.draw_cell(pos)
 
     def reveal_cells(self, pos_list):
         for pos in pos_list:
@@ -279,7 +451,6 @@ class Grid:
         cell = self.cells.get(pos)
         if not cell.is_blank() and not cell.is_correct():
             cell.marked_wrong = True
-            self.draw_cell(pos)
 
     def check_cells(self, pos_list):
         for pos in pos_list:
@@ -287,6 +458,8 @@ class Grid:
 
     def to_term(self, position):
         point_x, point_y = position
+        if self.compact:
+            return (self.grid_y + point_y, self.grid_x + 2 * point_x)
         term_x = self.grid_x + (4 * point_x) + 2
         term_y = self.grid_y + (2 * point_y) + 1
         return (term_y, term_x)
@@ -321,6 +494,9 @@ class Grid:
 
         if cell.circled:
             value = encircle(value)
+        elif self.compact and cell.is_blank():
+            # Without borders, an empty square needs something to show.
+            value = chars.middot
 
         if cell.marked_wrong:
             value = self.term.red(value.lower())
@@ -351,14 +527,23 @@ class Grid:
         value = self.term.reverse(value) + markup
         print(self.term.move(*self.to_term(position)) + value)
 
-    def get_notification_input(self, message, timeout=5, chars=3,
+    def draw_hint(self, position, letter, under_cursor=False):
+        value = self.term.dim(letter.lower())
+        if under_cursor:
+            value = self.term.reverse(value)
+        print(self.term.move(*self.to_term(position)) + value)
+
+    def draw_peer_cell(self, position):
+        value, markup = self.compile_cell(position)
+        value = self.term.on_blue(value) + markup
+        print(self.term.move(*self.to_term(position)) + value)
+
+    async def get_notification_input(self, message, timeout=5, chars=3,
             input_condition=str.isalnum, blocking=False):
 
         # If there's already a notification timer running, stop it.
-        try:
+        if self.notification_timer:
             self.notification_timer.cancel()
-        except:
-            pass
 
         input_phrase = message + " "
         key_input_place = len(input_phrase)
@@ -369,18 +554,22 @@ class Grid:
         user_input = ''
         keypress = None
         while keypress != '' and len(user_input) < chars:
-            keypress = self.term.inkey(timeout)
+            keypress = await self.session.next_key(timeout)
             if input_condition(keypress):
                 user_input += keypress
                 print(self.term.move(self.notification_area[0],
                         self.notification_area[1] + key_input_place),
                         user_input)
-            elif keypress.name in ['KEY_DELETE']:
+            elif keypress.name in ['KEY_DELETE', 'KEY_BACKSPACE']:
                 user_input = user_input[:-1]
                 print(self.term.move(self.notification_area[0],
                         self.notification_area[1] + key_input_place),
                         user_input + self.term.clear_eol)
-            elif blocking and keypress.name not in ['KEY_ENTER', 'KEY_ESCAPE']:
+            elif blocking and keypress.name == 'KEY_ESCAPE':
+                # A blocking prompt is only answered with enter; escape
+                # cancels it.
+                return None
+            elif blocking and keypress.name != 'KEY_ENTER':
                 continue
             else:
                 break
@@ -388,17 +577,135 @@ class Grid:
         return user_input
 
     def send_notification(self, message, timeout=5):
-        self.notification_timer = threading.Timer(timeout,
-                self.clear_notification_area)
-        self.notification_timer.daemon = True
+        if self.notification_timer:
+            self.notification_timer.cancel()
         print(self.term.move(*self.notification_area)
                 + self.term.reverse(message) + self.term.clear_eol)
-        self.notification_timer.start()
+        self.notification_timer = self.session.call_later(timeout,
+                self.clear_notification_area)
 
     def clear_notification_area(self):
         print(self.term.move(*self.notification_area) + self.term.clear_eol)
 
 
+class CluePane:
+    """A scrolling list of every clue, drawn beside the grid."""
+    # Only visible clues are wrapped, and only rows whose text or
+    # highlight changed are reprinted.
+    def __init__(self, grid, x, y, width, height, downs_only=False):
+        self.grid = grid
+        self.term = grid.term
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+        self.wrapper = textwrap.TextWrapper(width=width,
+                                            subsequent_indent='    ')
+
+        # Each entry is (direction, word index, text); headers and the
+        # spacer between the two lists have no direction.
+        self.entries = [(None, None, "ACROSS")]
+        for idx, word in enumerate(grid.across_words):
+            clue = "—" if downs_only else grid.across_clues[idx]
+            self.entries.append(("across", idx, "{}. {}".format(
+                grid.cells.get(word[0]).number, clue)))
+        self.entries += [(None, None, ""), (None, None, "DOWN")]
+        for idx, word in enumerate(grid.down_words_grouped):
+            self.entries.append(("down", idx, "{}. {}".format(
+                grid.cells.get(word[0]).number, grid.down_clues[idx])))
+
+        self.entry_index = {(direction, idx): entry
+                            for entry, (direction, idx, _)
+                            in enumerate(self.entries) if direction}
+
+        self.cell_words = {}
+        for direction, group in (("across", grid.across_words),
+                                 ("down", grid.down_words_grouped)):
+            for idx, word in enumerate(group):
+                for pos in word:
+                    self.cell_words.setdefault(pos, {})[direction] = idx
+
+        self.wrapped = {}
+        self.top = 0
+        self.rows = [None] * height
+
+    def lines(self, entry):
+        if entry not in self.wrapped:
+            text = self.entries[entry][2]
+            self.wrapped[entry] = self.wrapper.wrap(text) or ['']
+        return self.wrapped[entry]
+
+    def scroll_to(self, entry):
+        if entry < self.top:
+            self.top = entry
+            return
+
+        # Walk back up from the entry to find the smallest scroll that
+        # shows all of it, wrapping only clues that will be on screen.
+        used = 0
+        top = entry
+        while top >= self.top:
+            used += len(self.lines(top))
+            if used > self.height:
+                break
+            top -= 1
+        self.top = min(entry, top + 1)
+
+    def update(self, cursor):
+        words = self.cell_words.get(cursor.position, {})
+        crossing_direction = ("down" if cursor.direction == "across"
+                              else "across")
+        current = self.entry_index.get(
+                (cursor.direction, words.get(cursor.direction)))
+        crossing = self.entry_index.get(
+                (crossing_direction, words.get(crossing_direction)))
+
+        if current is not None:
+            # Keep the header visible when the first clue is current.
+            self.scroll_to(current)
+            if self.top == current and self.entries[current - 1][0] is None:
+                self.top = current - 1
+
+        rows = []
+        entry = self.top
+        while len(rows) < self.height and entry < len(self.entries):
+            if entry == current:
+                style = "current"
+            elif entry == crossing:
+                style = "crossing"
+            elif self.entries[entry][0] is None:
+                style = "header"
+            else:
+                style = ""
+            for line in self.lines(entry):
+                rows.append((line, style))
+            entry += 1
+        rows = rows[:self.height]
+        rows += [("", "")] * (self.height - len(rows))
+
+        for row, (new, old) in enumerate(zip(rows, self.rows)):
+            if new != old:
+                self.draw_row(row, *new)
+        self.rows = rows
+
+    def draw_row(self, row, text, style):
+        text = text.ljust(self.width)
+        if style == "current":
+            text = self.term.reverse(text)
+        elif style == "crossing":
+            text = self.term.underline(text)
+        elif style == "header":
+            text = self.term.bold(text)
+        print(self.term.move(self.y + row, self.x) + text)
+
+    def clear(self):
+        for row, old in enumerate(self.rows):
+            if old != ("", ""):
+                self.draw_row(row, "", "")
+        self.rows = [("", "")] * self.height
+
+
 class Cursor:
     def __init__(self, position, direction, grid):
         self.position = position
@@ -581,8 +888,8 @@ class Cursor:
 
         return word
 
-    def go_to_numbered_square(self):
-        num = self.grid.get_notification_input("Enter square number:",
+    async def go_to_numbered_square(self):
+        num = await self.grid.get_notification_input("Enter square number:",
                                                input_condition=str.isdigit)
         if num:
             pos = next((pos for pos in self.grid.cells
@@ -598,39 +905,47 @@ class Cursor:
             self.grid.send_notification("No valid number entered.")
 
 
-class Timer(threading.Thread):
+class Timer:
     def __init__(self, grid, starting_seconds=0, is_running=True, active=True):
         self.starting_seconds = starting_seconds
         self.is_running = is_running
         self.active = active
 
-        super().__init__(daemon=True)
-
         self.grid = grid
 
-    def run(self):
         self.start_time = time.time()
         self.time_passed = self.starting_seconds
 
-        self.show_time()
+    async def run(self):
+        self.start_time = time.time()
+        self.time_passed = self.starting_seconds
+
+        self.grid.session.post(self.show_time)
 
         while self.active:
             if self.is_running:
                 self.time_passed = (self.starting_seconds
                                    + int(time.time() - self.start_time))
-                self.show_time()
+                self.grid.session.post(self.show_time)
 
-            time.sleep(0.5)
+            await asyncio.sleep(0.5)
 
     def show_time(self):
         y_coord = 2
-        x_coord = self.grid.grid_x + self.grid.column_count * 4 - 7
+        x_coord = (self.grid.grid_x
+                   + self.grid.cell_width * self.grid.column_count - 7)
 
         print(self.grid.term.move(y_coord, x_coord)
                 + self.display_format())
 
-    def display_format(self):
-        time_amount = self.time_passed
+    def elapsed(self):
+        """Return the solving time so far, to a fraction of a second."""
+        if self.is_running and self.active:
+            return self.starting_seconds + time.time() - self.start_time
+        return self.time_passed
+
+    def display_format(self, seconds=None):
+        time_amount = self.time_passed if seconds is None else int(seconds)
 
         m, s = divmod(time_amount, 60)
         h, m = divmod(m, 60)
@@ -659,6 +974,1121 @@ class Timer(threading.Thread):
         self.is_running = True
 
 
+class Tally:
+    """Running counts of blank, wrong and right squares."""
+    def __init__(self, grid):
+        self.grid = grid
+        self.status = {}
+        self.counts = {'blank': 0, 'wrong': 0, 'right': 0, 'marked': 0}
+        for pos, cell in grid.cells.items():
+            if cell.is_letter():
+                self.update(pos)
+
+    def update(self, pos):
+        cell = self.grid.cells.get(pos)
+        if cell.is_blank():
+            state = 'blank'
+        elif cell.entry == cell.solution:
+            state = 'right'
+        else:
+            state = 'wrong'
+        marked = cell.marked_wrong and not cell.is_blank()
+
+        old = self.status.get(pos)
+        if old == (state, marked):
+            return
+        if old:
+            self.counts[old[0]] -= 1
+            self.counts['marked'] -= old[1]
+        self.counts[state] += 1
+        self.counts['marked'] += marked
+        self.status[pos] = (state, marked)
+
+    def cells_changed(self, changes, origin):
+        for change in changes:
+            self.update(change.position)
+
+    def blankish(self):
+        return self.counts['blank'] + self.counts['marked']
+
+    def is_complete(self):
+        return not (self.counts['blank'] or self.counts['wrong'])
+
+
+class EventQueue:
+    """Keystrokes and posted callbacks, consumed in order by one task."""
+    def __init__(self, term):
+        self.term = term
+        self.events = asyncio.Queue()
+        self.tasks = set()
+
+    def post(self, callback, *args):
+        self.events.put_nowait((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        loop = asyncio.get_running_loop()
+        return loop.call_later(delay, self.post, callback, *args)
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def read_keys(self):
+        keypress = self.term.inkey(timeout=0)
+        while keypress:
+            self.events.put_nowait(keypress)
+            keypress = self.term.inkey(timeout=0)
+
+    async def next_key(self, timeout=None):
+        # Render callbacks posted while we wait are run here, so that
+        # prompts waiting for input don't hold up the timer display.
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - loop.time()
+            try:
+                event = await asyncio.wait_for(self.events.get(), remaining)
+            except asyncio.TimeoutError:
+                return Keystroke('')
+
+            if isinstance(event, Keystroke):
+                return event
+
+            callback, args = event
+            callback(*args)
+
+    def start_input(self):
+        asyncio.get_running_loop().add_reader(sys.stdin.fileno(),
+                                              self.read_keys)
+
+    def stop_input(self):
+        asyncio.get_running_loop().remove_reader(sys.stdin.fileno())
+
+
+class Session(EventQueue):
+    """Runs one puzzle on an asyncio loop."""
+    # Everything that touches the screen runs in the task reading the
+    # event queue; background jobs render by posting callbacks.
+    def __init__(self, grid, cursor, timer, filename,
+                 clue_wrapper, info_location, downs_only=False, peer=None,
+                 wordlist_path=None, clue_pane=None, autocheck=False,
+                 recorder=None, bindings=None,
+                 history_size=history.DEFAULT_CAPACITY):
+        super().__init__(grid.term)
+        self.grid = grid
+        self.cursor = cursor
+        self.timer = timer
+        self.filename = filename
+        self.clue_wrapper = clue_wrapper
+        self.info_location = info_location
+        self.downs_only = downs_only
+        self.clue_pane = clue_pane
+        self.peer = peer
+        self.peer_cursors = {}
+        self.wordlist_path = wordlist_path
+        self.word_index = None
+        self.propagator = None
+        self.history = history.History(history_size)
+        self.tally = Tally(grid)
+        self.autocheck = autocheck
+        self.shown_counts = None
+        self.shown_numbers = None
+        self.clue_index = None
+        self.last_search = ''
+
+        # Set when the puzzle is one of several open in tabs.
+        self.tabs = None
+        self.switch_to = None
+
+        self.grid.session = self
+
+        grid.bus.subscribe(self.tally.cells_changed)
+        grid.bus.subscribe(self.cells_changed)
+
+        self.recorder = recorder
+        if recorder:
+            grid.bus.subscribe(recorder.cells_changed)
+
+        # Each command is handled by the do_ method of the same name.
+        handlers = {command: getattr(self, 'do_' + command.replace('-', '_'))
+                    for command in keymap.COMMANDS}
+        self.key_table = (bindings or keymap.Keymap()).table(handlers)
+
+        self.old_word = []
+        self.old_position = cursor.position
+        self.overwrite_mode = False
+        self.puzzle_paused = False
+        self.puzzle_complete = False
+        self.modified_since_save = False
+        self.to_quit = False
+
+    async def run(self):
+        self.start_input()
+        self.spawn(self.timer.run())
+
+        if self.wordlist_path and not self.word_index:
+            self.spawn(self.load_word_index())
+
+        if self.peer:
+            await self.peer.connect()
+            self.spawn(self.peer.listen(self))
+            self.spawn(self.peer.flush_forever())
+            self.apply_remote({'p': self.peer.cursors_at_join})
+
+        try:
+            while not self.to_quit and self.switch_to is None:
+                self.render()
+                keypress = await self.next_key()
+                await self.handle_key(keypress)
+                self.grid.bus.flush()
+                if self.peer:
+                    self.send_cursor()
+        finally:
+            if self.peer:
+                self.peer.flush()
+                self.peer.close()
+            if self.recorder:
+                self.recorder.close()
+            self.stop_input()
+            for task in list(self.tasks):
+                task.cancel()
+
+    def render(self):
+        grid, cursor, term = self.grid, self.cursor, self.term
+
+        # First up we draw all the necessary stuff. If the current word
+        # is different from the word the last time through the loop:
+        if cursor.current_word() is not self.old_word:
+            self.overwrite_mode = False
+            for pos in self.old_word:
+                grid.draw_cell(pos)
+            for pos in cursor.current_word():
+                grid.draw_highlighted_cell(pos)
+
+        # Draw the clue for the new word:
+            if cursor.direction == "across":
+                num_index = grid.across_words.index(
+                        cursor.current_word())
+                clue = grid.across_clues[num_index]
+                if self.downs_only:
+                    clue = "—"
+            elif cursor.direction == "down":
+                num_index = grid.down_words_grouped.index(
+                        cursor.current_word())
+                clue = grid.down_clues[num_index]
+
+            num = str(grid.cells.get(cursor.current_word()[0]).number)
+            compiled_clue = (num + " " + cursor.direction.upper()
+                            + ": " + clue)
+            wrapped_clue = self.clue_wrapper.wrap(compiled_clue)
+            wrapped_clue += [''] * (3 - len(wrapped_clue))
+            if self.clue_pane:
+                # Pad rather than clear to the end of the line, which
+                # would erase the clue pane.
+                wrapped_clue = [line.ljust(self.clue_wrapper.width)
+                                for line in wrapped_clue]
+            else:
+                wrapped_clue = [line + term.clear_eol
+                                for line in wrapped_clue]
+
+            # This is fun: since we're in raw mode, \n isn't sufficient to
+            # return the printing location to the first column. If you 
+            # don't also have \r,
+            # it
+            #    prints
+            #           like
+            #                this after each newline
+            print(term.move(self.info_location['y'], self.info_location['x'])
+                    + '\r\n'.join(wrapped_clue))
+
+        # Otherwise, just draw the old square now that it's not under
+        # the cursor
+        else:
+            grid.draw_highlighted_cell(self.old_position)
+
+        grid.draw_cursor_cell(cursor.position)
+
+        # Check if the puzzle is complete!
+        if not self.puzzle_complete and self.tally.is_complete():
+            self.puzzle_complete = True
+            with term.location(x=grid.grid_x, y=2):
+                print(term.reverse("You've completed the puzzle!"),
+                        term.clear_eol)
+            self.timer.show_time()
+            self.timer.active = False
+
+        if self.autocheck and not self.puzzle_complete:
+            self.show_status()
+
+        if grid.compact:
+            self.show_numbers()
+
+        if not self.puzzle_paused:
+            for pos in self.peer_cursors.values():
+                if pos != cursor.position:
+                    grid.draw_peer_cell(pos)
+
+            if self.clue_pane:
+                self.clue_pane.update(cursor)
+
+        self.old_position = cursor.position
+        self.old_word = cursor.current_word()
+
+    async def search_clues(self):
+        grid, cursor = self.grid, self.cursor
+
+        if not self.clue_index:
+            self.search_entries = []
+            if not self.downs_only:
+                self.search_entries += [
+                        ('across', i, clue)
+                        for i, clue in enumerate(grid.across_clues)]
+            self.search_entries += [('down', i, clue)
+                                    for i, clue in enumerate(grid.down_clues)]
+            self.clue_index = search.ClueIndex(
+                    [clue for _, _, clue in self.search_entries])
+
+        query = await grid.get_notification_input(
+                "Search clues:", timeout=15, chars=40,
+                input_condition=str.isprintable, blocking=True)
+        if query is None:
+            grid.send_notification("Search canceled.")
+            return
+        query = query.strip() or self.last_search
+        if not query:
+            grid.send_notification("No search entered.")
+            return
+        self.last_search = query
+
+        matches = self.clue_index.search(query)
+        if not matches:
+            grid.send_notification("No clues match '{}'.".format(query))
+            return
+
+        # Start after the current word, so that searching again moves on
+        # to the next match.
+        current = next((i for i, (direction, idx, _)
+                        in enumerate(self.search_entries)
+                        if direction == cursor.direction and
+                        self.entry_word(direction, idx) is
+                        cursor.current_word()), -1)
+        match = next((i for i in matches if i > current), matches[0])
+
+        direction, idx, _ = self.search_entries[match]
+        cursor.direction = direction
+        cursor.position = self.entry_word(direction, idx)[0]
+        grid.send_notification("Match {} of {} for '{}'.".format(
+            matches.index(match) + 1, len(matches), query))
+
+    def entry_word(self, direction, idx):
+        if direction == 'across':
+            return self.grid.across_words[idx]
+        return self.grid.down_words_grouped[idx]
+
+    def show_status(self):
+        counts = (self.tally.counts['blank'], self.tally.counts['wrong'])
+        if counts == self.shown_counts:
+            return
+        self.shown_counts = counts
+
+        # Leave room for the timer on the same line.
+        width = self.grid.cell_width * self.grid.column_count - 8
+        status = "{} blank, {} wrong".format(*counts)
+        if len(status) > width:
+            status = "{} left, {} ✗".format(*counts)
+        with self.term.location(x=self.grid.grid_x, y=2):
+            print(status[:width].ljust(width), end='')
+
+    def show_numbers(self):
+        # The compact layout has no room for numbers in the squares, so
+        # the numbers of the words under the cursor go above the grid.
+        grid, position = self.grid, self.cursor.position
+        numbers = []
+        for direction, words in (("across", grid.across_words),
+                                 ("down", grid.down_words)):
+            word = next((w for w in words if position in w), None)
+            if word:
+                numbers.append("{} {}".format(
+                    grid.cells.get(word[0]).number, direction))
+
+        status = " · ".join(numbers)
+        if status == self.shown_numbers:
+            return
+        self.shown_numbers = status
+        with self.term.location(x=grid.grid_x, y=grid.grid_y - 1):
+            print(status + self.term.clear_eol, end='')
+
+    async def load_word_index(self):
+        # Building the index the first time takes a few seconds, so it
+        # happens off the event loop.
+        loop = asyncio.get_running_loop()
+        try:
+            self.word_index = await loop.run_in_executor(
+                    None, wordlist.WordIndex.open, self.wordlist_path)
+        except (OSError, ValueError):
+            self.post(self.grid.send_notification,
+                      "Unable to load word list {}.".format(
+                          self.wordlist_path))
+
+    def show_candidates(self):
+        grid = self.grid
+
+        if not self.word_index:
+            if self.wordlist_path:
+                grid.send_notification("Word list is still loading.")
+            else:
+                grid.send_notification("No word list available.")
+            return
+
+        pattern = ''.join('?' if grid.cells.get(pos).is_blankish()
+                          else grid.cells.get(pos).entry
+                          for pos in self.cursor.current_word())
+
+        width = self.term.width - grid.notification_area[1] - 1
+        prefix = pattern + ": "
+        limit = (width - len(prefix)) // (len(pattern) + 1) + 1
+        words = self.word_index.matches(pattern, limit=limit)
+
+        if words:
+            message = prefix + ' '.join(words)
+            if len(message) > width:
+                message = message[:width - 1] + "…"
+        else:
+            message = prefix + "no matches in word list"
+
+        grid.send_notification(message, timeout=10)
+
+    def show_forced(self):
+        grid = self.grid
+
+        if not self.word_index:
+            if self.wordlist_path:
+                grid.send_notification("Word list is still loading.")
+            else:
+                grid.send_notification("No word list available.")
+            return
+
+        # The first request does a full propagation; after that the
+        # propagator is kept current as squares change.
+        if not self.propagator:
+            self.propagator = solver.Propagator(grid, self.word_index)
+            grid.bus.subscribe(self.propagator.cells_changed)
+
+        forced = self.propagator.forced()
+        for pos, letter in forced:
+            grid.draw_hint(pos, letter, pos == self.cursor.position)
+
+        if forced:
+            message = "{} forced square{} shown in the grid.".format(
+                    len(forced), '' if len(forced) == 1 else 's')
+        else:
+            message = "No squares are forced by the word list."
+
+        contradictions = self.propagator.contradicted_words()
+        if contradictions:
+            message += " Nothing fits " + ", ".join(contradictions) + "."
+
+        grid.send_notification(message, timeout=10)
+
+    def redraw_cell(self, pos):
+        if pos == self.cursor.position:
+            self.grid.draw_cursor_cell(pos)
+        elif pos in self.cursor.current_word():
+            self.grid.draw_highlighted_cell(pos)
+        elif pos in self.peer_cursors.values():
+            self.grid.draw_peer_cell(pos)
+        else:
+            self.grid.draw_cell(pos)
+
+    def replay(self, changes):
+        grid = self.grid
+        if not changes:
+            return False
+
+        positions = []
+        for idx, entry, md in changes:
+            row, col = divmod(idx, grid.column_count)
+            cell = grid.cells.get((col, row))
+            cell.entry = entry
+            cell.set_markup(md | cell.get_markup() & 128)
+            positions.append((col, row))
+
+        # Follow a single-square change, as after undoing a typed letter.
+        if len(positions) == 1:
+            self.cursor.position = positions[0]
+            if not self.cursor.current_word():
+                self.cursor.switch_direction()
+
+        grid.bus.flush('history')
+        return True
+
+    def cells_changed(self, changes, origin):
+        if origin == 'local':
+            self.history.record(changes)
+        if origin != 'remote':
+            self.modified_since_save = True
+            if self.peer:
+                self.peer.queue_cells([change.index, change.entry,
+                                       change.markup]
+                                      for change in changes)
+
+        if not self.puzzle_paused:
+            for change in changes:
+                self.redraw_cell(change.position)
+
+    def send_cursor(self):
+        position = list(self.cursor.position) + [self.cursor.direction[0]]
+        if position != self.peer.position:
+            self.peer.position = position
+            self.peer.queue(p=position)
+
+    def apply_remote(self, message):
+        grid = self.grid
+        changed = []
+
+        # Anything changed locally so far goes out first, so it isn't
+        # mistaken for part of the remote batch.
+        grid.bus.flush()
+        changes = message.get('c')
+        for change in changes if isinstance(changes, list) else []:
+            try:
+                idx, entry, md = change
+                row, col = divmod(idx, grid.column_count)
+            except (TypeError, ValueError):
+                continue
+            cell = grid.cells.get((col, row))
+            if (cell and cell.is_letter() and isinstance(entry, str)
+                    and isinstance(md, int)):
+                cell.entry = entry
+                cell.set_markup(md)
+        grid.bus.flush('remote')
+
+        cursors = message.get('p')
+        if not isinstance(cursors, dict):
+            cursors = {}
+        for player, position in cursors.items():
+            old_position = self.peer_cursors.pop(player, None)
+            if old_position:
+                changed.append(old_position)
+            if isinstance(position, list) and len(position) >= 2:
+                self.peer_cursors[player] = tuple(position[:2])
+
+        if self.puzzle_paused:
+            return
+
+        for pos in changed:
+            self.redraw_cell(pos)
+        self.render()
+
+    def disconnected(self):
+        self.peer = None
+        old_cursors = list(self.peer_cursors.values())
+        self.peer_cursors = {}
+        if not self.puzzle_paused:
+            for pos in old_cursors:
+                self.redraw_cell(pos)
+        self.grid.send_notification("Lost connection to the co-op server.")
+
+    async def handle_key(self, keypress):
+        if self.puzzle_paused:
+            mode = 'paused'
+        elif self.puzzle_complete:
+            mode = 'complete'
+        else:
+            mode = 'solving'
+
+        handler = self.key_table.get((keymap.key_name(keypress),
+                                      self.cursor.direction, mode))
+        if handler:
+            await handler()
+        elif mode == 'solving' and keypress.isalnum():
+            self.enter_letter(keypress)
+
+    def enter_letter(self, keypress):
+        grid, cursor = self.grid, self.cursor
+        current_cell = grid.cells.get(cursor.position)
+
+        if not current_cell.is_blankish():
+            self.overwrite_mode = True
+        current_cell.entry = keypress.upper()
+
+        if current_cell.marked_wrong:
+            current_cell.marked_wrong = False
+            current_cell.corrected = True
+        if self.autocheck:
+            grid.check_cell(cursor.position)
+        cursor.advance_within_word(self.overwrite_mode, wrap_mode=True)
+
+    async def do_quit(self):
+        modified = self.modified_since_save
+        if self.tabs:
+            modified = self.tabs.modified()
+        self.to_quit = await self.grid.confirm_quit(modified)
+        if not self.to_quit:
+            self.grid.send_notification("Quit command canceled.")
+
+    async def do_save(self):
+        if self.peer:
+            self.peer.queue(s=1)
+            self.grid.send_notification("Asked the co-op server to save.")
+        elif not self.save():
+            # A joined puzzle has no file of its own to save to.
+            self.grid.send_notification(
+                    "Disconnected from the co-op server; nothing saved.")
+            return
+        self.modified_since_save = False
+
+    def save(self):
+        if not self.filename:
+            return False
+        grid = self.grid
+        grid.puzfile.extensions[puz.Extensions.Timer] = \
+                self.timer.save_format()
+        grid.save(self.filename)
+        return True
+
+    async def do_pause(self):
+        grid, timer = self.grid, self.timer
+        if timer.is_running:
+            timer.pause()
+            self.show_paused()
+            self.puzzle_paused = True
+
+        else:
+            timer.unpause()
+            grid.fill()
+            self.old_word = []
+
+            self.puzzle_paused = False
+
+    def show_paused(self):
+        term = self.term
+        self.grid.draw()
+
+        with term.location(**self.info_location):
+            print('\r\n'.join(['PUZZLE PAUSED' + term.clear_eol,
+                               term.clear_eol,
+                               term.clear_eol]))
+
+        if self.clue_pane:
+            self.clue_pane.clear()
+
+    async def do_reset(self):
+        grid, timer = self.grid, self.timer
+        confirm = await grid.confirm_reset()
+        if confirm:
+            grid.send_notification("Puzzle reset.")
+            for pos in grid.cells:
+                cell = grid.cells.get(pos)
+                if cell.is_letter():
+                    cell.clear()
+                    cell.corrected = False
+                    cell.revealed = False
+            timer.starting_seconds = timer.time_passed = 0
+            timer.start_time = time.time()
+            timer.show_time()
+            self.modified_since_save = True
+            if not self.puzzle_paused:
+                self.old_word = []
+        else:
+            grid.send_notification("Reset command canceled.")
+
+    async def do_check(self):
+        grid, cursor = self.grid, self.cursor
+        group = await grid.get_notification_input(
+                "Check (l)etter, (w)ord, or (p)uzzle?",
+                chars=1)
+        scope = ''
+        if group.lower() == 'l':
+            scope = 'letter'
+            grid.check_cell(cursor.position)
+        elif group.lower() == 'w':
+            scope = 'word'
+            grid.check_cells(cursor.current_word())
+        elif group.lower() == 'p':
+            scope = 'puzzle'
+            grid.check_cells(grid.cells)
+
+        if scope:
+            grid.send_notification("Checked {scope} for errors.".
+                    format(scope=scope))
+        else:
+            grid.send_notification("No valid input entered.")
+
+        self.old_word = []
+
+    async def do_go_to(self):
+        await self.cursor.go_to_numbered_square()
+
+    async def do_search(self):
+        await self.search_clues()
+
+    async def do_forced(self):
+        self.show_forced()
+
+    async def do_suggest(self):
+        self.show_candidates()
+
+    async def do_undo(self):
+        if not self.replay(self.history.undo()):
+            self.grid.send_notification("Nothing to undo.")
+
+    async def do_redo(self):
+        if not self.replay(self.history.redo()):
+            self.grid.send_notification("Nothing to redo.")
+
+    async def do_clear(self):
+        grid = self.grid
+        confirm = await grid.confirm_clear()
+        if confirm:
+            grid.send_notification("Puzzle cleared.")
+            for pos in grid.cells:
+                cell = grid.cells.get(pos)
+                if cell.is_letter():
+                    cell.clear()
+            self.old_word = []
+        else:
+            grid.send_notification("Clear command canceled.")
+
+    async def do_reveal(self):
+        grid, cursor = self.grid, self.cursor
+        group = await grid.get_notification_input(
+                "Reveal (l)etter, (w)ord, or (p)uzzle?",
+                chars=1)
+        scope = ''
+        if group.lower() == 'l':
+            scope = 'letter'
+            grid.reveal_cell(cursor.position)
+        elif group.lower() == 'w':
+            scope = 'word'
+            grid.reveal_cells(cursor.current_word())
+        elif group.lower() == 'p':
+            scope = 'puzzle'
+            grid.reveal_cells(grid.cells)
+
+        if scope:
+            grid.send_notification("Revealed answers for {scope}.".
+                    format(scope=scope))
+        else:
+            grid.send_notification("No valid input entered.")
+
+        self.old_word = []
+
+    async def do_next_tab(self):
+        self.switch_tab(1)
+
+    async def do_previous_tab(self):
+        self.switch_tab(-1)
+
+    def switch_tab(self, step):
+        if self.tabs and len(self.tabs) > 1:
+            self.switch_to = step
+        else:
+            self.grid.send_notification("No other puzzles are open.")
+
+    async def do_delete(self):
+        self.grid.cells.get(self.cursor.position).clear()
+        self.overwrite_mode = True
+        self.cursor.retreat_within_word(end_placement=True)
+
+    async def do_next_blank(self):
+        cursor = self.cursor
+        if self.grid.cells.get(cursor.position).is_blankish():
+            cursor.advance_to_next_word(blank_placement=True)
+        else:
+            cursor.advance_within_word(overwrite_mode=False)
+
+    async def do_previous_blank(self):
+        self.cursor.retreat_within_word(blank_placement=True)
+
+    async def do_next_word(self):
+        self.cursor.advance_to_next_word()
+
+    async def do_previous_word(self):
+        self.cursor.retreat_to_previous_word()
+
+    async def do_switch_direction(self):
+        self.cursor.switch_direction()
+        if not self.cursor.current_word():
+            self.cursor.switch_direction()
+
+    async def do_advance(self):
+        self.cursor.advance()
+
+    async def do_retreat(self):
+        self.cursor.retreat()
+
+    async def do_next_line(self):
+        self.cursor.advance_perpendicular()
+
+    async def do_next_line_blank(self):
+        cursor = self.cursor
+        cursor.advance_perpendicular()
+        if self.tally.blankish():
+            while not self.grid.cells.get(cursor.position).is_blankish():
+                cursor.advance_perpendicular()
+
+    async def do_previous_line(self):
+        self.cursor.retreat_perpendicular()
+
+    async def do_previous_line_blank(self):
+        cursor = self.cursor
+        cursor.retreat_perpendicular()
+        if self.tally.blankish():
+            while not self.grid.cells.get(cursor.position).is_blankish():
+                cursor.retreat_perpendicular()
+
+class Tabs:
+    """Several puzzles open at once, one of them on screen."""
+    # Recent tabs keep their Session in a cache bounded by its estimated
+    # memory; older ones keep only a Snapshot and are rebuilt when shown.
+    def __init__(self, filenames, term, version, bindings, cache_size,
+                 compact=False, clue_pane=False, downs_only=False,
+                 autocheck=False, wordlist_path=None):
+        self.filenames = filenames
+        self.term = term
+        self.version = version
+        self.bindings = bindings
+        self.commands = toolbar_commands(bindings)
+        self.cache_size = cache_size
+        self.compact = compact
+        self.clue_pane = clue_pane
+        self.downs_only = downs_only
+        self.autocheck = autocheck
+        self.wordlist_path = wordlist_path
+
+        self.current = 0
+        self.session = None
+        self.cache = collections.OrderedDict()
+        self.snapshots = {}
+        self.word_index = None
+        self.preloading = None
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def name(self, index):
+        filename = self.filenames[index]
+        member = pack.split_member(filename)
+        if member:
+            return member[1]
+        return os.path.splitext(os.path.basename(filename))[0]
+
+    def build(self, index, puzfile, lock_key):
+        """Make a tab's session from its puzzle, just read from the file."""
+        snapshot = self.snapshots.get(index)
+        if snapshot:
+            puzfile.fill = snapshot.fill
+            puzfile.extensions[puz.Extensions.Timer] = snapshot.timer
+            if any(snapshot.markup):
+                puzfile.extensions[puz.Extensions.Markup] = snapshot.markup
+            else:
+                puzfile.extensions.pop(puz.Extensions.Markup, None)
+
+        grid = Grid(2, 4, self.term, compact=self.compact)
+        grid.load(puzfile)
+        grid.lock_key = lock_key
+        problem = layout_problem(self.term, grid, clue_pane=self.clue_pane)
+        if problem:
+            raise ValueError(problem)
+
+        if snapshot:
+            cursor = Cursor(snapshot.position, snapshot.direction, grid)
+        else:
+            cursor = Cursor(grid.across_words[0][0], "across", grid)
+        timer = Timer(grid, starting_seconds=int(grid.start_time),
+                      is_running=True, active=bool(int(grid.timer_active)))
+
+        # The clue's place on the screen is set when the tab is shown.
+        session = Session(grid, cursor, timer, self.filenames[index],
+                          None, None, downs_only=self.downs_only,
+                          wordlist_path=self.wordlist_path,
+                          autocheck=self.autocheck, bindings=self.bindings)
+        session.tabs = self
+        if snapshot:
+            session.modified_since_save = snapshot.modified
+            del self.snapshots[index]
+        return session
+
+    def open(self, index):
+        """Return a tab's session, from the cache or from its file."""
+        if index in self.cache:
+            return self.cache.pop(index)[0]
+        return self.build(index, *read_puzzle(self.filenames[index]))
+
+    def snapshot(self, session):
+        grid, cursor = session.grid, session.cursor
+        grid.update_puzfile()
+        markup = bytes(cell.get_markup() for cell in grid.cells.values())
+        return Snapshot(grid.puzfile.fill, markup, session.timer.save_format(),
+                        cursor.position, cursor.direction,
+                        session.modified_since_save)
+
+    def footprint(self, session):
+        """Roughly estimate the bytes a tab's session holds."""
+        grid = session.grid
+        parts = [grid.cells, session.tally.status, session.history.buffer]
+        parts += grid.cells.values()
+        parts += grid.across_words + grid.down_words
+        parts += grid.across_clues + grid.down_clues + grid.puzfile.clues
+        return sum(map(sys.getsizeof, parts))
+
+    def stash(self, index, session):
+        """Put a session in the cache, evicting the oldest beyond its size."""
+        self.cache[index] = (session, self.footprint(session))
+        total = sum(size for _, size in self.cache.values())
+        while self.cache and total > self.cache_size:
+            evicted, (old, size) = self.cache.popitem(last=False)
+            self.snapshots[evicted] = self.snapshot(old)
+            total -= size
+
+    async def preload(self, index):
+        if index == self.current or index in self.cache:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            puzfile, lock_key = await loop.run_in_executor(
+                    None, read_puzzle, self.filenames[index])
+            # It may have been opened while it was being read.
+            if index == self.current or index in self.cache:
+                return
+            session = self.build(index, puzfile, lock_key)
+        except ValueError:
+            # It'll be skipped, with the reason, when it's switched to.
+            return
+        self.stash(index, session)
+
+    def modified(self):
+        sessions = [self.session] + [session for session, _
+                                     in self.cache.values()]
+        return (any(session.modified_since_save for session in sessions) or
+                any(snapshot.modified for snapshot
+                    in self.snapshots.values()))
+
+    def switch(self, step):
+        """Leave the current tab for the next one that opens."""
+        session = self.session
+        if session.timer.is_running:
+            session.timer.pause()
+        if session.word_index:
+            self.word_index = session.word_index
+
+        index = self.current
+        skipped = []
+        for _ in range(len(self) - 1):
+            index = (index + step) % len(self)
+            try:
+                new = self.open(index)
+            except ValueError as e:
+                skipped.append("{}: {}".format(self.name(index), e))
+                continue
+
+            self.stash(self.current, session)
+            # Keys typed after the switch belong to the new tab.
+            while not session.events.empty():
+                event = session.events.get_nowait()
+                if isinstance(event, Keystroke):
+                    new.events.put_nowait(event)
+            self.current, self.session = index, new
+            break
+
+        return self.session, ' '.join(skipped) or None
+
+    def show(self):
+        session, term = self.session, self.term
+        grid, cursor = session.grid, session.cursor
+
+        print(term.clear())
+        grid.notification_area = (term.height - 2, grid.grid_x)
+        session.clue_wrapper, session.clue_pane, session.info_location = \
+            draw_screen(term, grid, self.version, self.commands,
+                        clue_pane=self.clue_pane, downs_only=self.downs_only)
+        self.show_tabs()
+
+        # The rest of the screen is drawn again on the next render.
+        session.shown_counts = session.shown_numbers = None
+        session.puzzle_complete = False
+        session.word_index = session.word_index or self.word_index
+        if session.puzzle_paused:
+            session.show_paused()
+            session.old_word = cursor.current_word()
+        else:
+            session.old_word = []
+            if not session.timer.is_running:
+                session.timer.unpause()
+
+    def show_tabs(self):
+        term, x = self.term, self.session.grid.grid_x
+        width = term.width - 2 * x
+        labels = [' {} '.format(self.name(index))
+                  for index in range(len(self))]
+
+        # Start far enough along that the current tab fits.
+        first = 0
+        while (first < self.current and
+               sum(len(label) + 1 for label
+                   in labels[first:self.current + 1]) > width):
+            first += 1
+
+        tabs, used = '', 0
+        for index in range(first, len(labels)):
+            label = labels[index]
+            if used + len(label) > width:
+                break
+            if index == self.current:
+                tabs += term.reverse(label) + ' '
+            else:
+                tabs += term.dim(label) + ' '
+            used += len(label) + 1
+
+        print(term.move(1, x) + tabs + term.clear_eol)
+
+    async def run(self, session):
+        self.session = session
+        message = None
+        try:
+            while True:
+                self.show()
+                if message:
+                    width = self.term.width - 2 * session.grid.grid_x
+                    session.grid.send_notification(message[:width])
+
+                if self.preloading:
+                    self.preloading.cancel()
+                self.preloading = asyncio.ensure_future(
+                        self.preload((self.current + 1) % len(self)))
+
+                await session.run()
+                if session.to_quit:
+                    break
+                step, session.switch_to = session.switch_to, None
+                session, message = self.switch(step)
+        finally:
+            if self.preloading:
+                self.preloading.cancel()
+
+
+class Replay(EventQueue):
+    """Plays a recorded solve back on the grid."""
+    SPEEDS = [0.25, 0.5, 1, 2, 4, 8, 16, 32, 64]
+    FRAME = 0.05
+
+    def __init__(self, grid, timer, solve):
+        super().__init__(grid.term)
+        self.grid = grid
+        self.timer = timer
+        self.solve = solve
+
+        self.position = 0
+        self.state, self.next_event = solve.state_at(0)
+        self.speed = self.SPEEDS.index(1)
+        self.playing = True
+        self.status = None
+        self.last_tick = None
+        self.frame = None
+
+        grid.bus.subscribe(self.cells_changed)
+
+    def cells_changed(self, changes, origin):
+        for change in changes:
+            self.grid.draw_cell(change.position)
+
+    def show(self):
+        entries, markup = self.state
+        for cell, entry, md in zip(self.grid.cells.values(), entries, markup):
+            if cell.is_letter():
+                cell.entry = entry
+                cell.set_markup(md)
+        self.grid.bus.flush('replay')
+
+        self.timer.time_passed = int(self.position)
+        self.timer.show_time()
+
+    def seek(self, seconds):
+        seconds = min(max(seconds, 0), self.solve.duration)
+        end = self.solve.index_at(seconds)
+
+        if (seconds < self.position or
+                end - self.next_event > recording.KEYFRAME_INTERVAL):
+            self.state, self.next_event = self.solve.state_at(seconds)
+        else:
+            for i in range(self.next_event, end):
+                self.solve.apply(self.state, i)
+            self.next_event = max(end, self.next_event)
+
+        self.position = seconds
+        self.show()
+
+    def show_status(self):
+        status = "{} {}x {} / {}".format(
+                "▶" if self.playing else "❚❚",
+                self.SPEEDS[self.speed],
+                self.timer.display_format(self.position).strip(),
+                self.timer.display_format(self.solve.duration).strip())
+        if status != self.status:
+            self.status = status
+            print(self.term.move(*self.grid.notification_area)
+                  + self.term.reverse(status) + self.term.clear_eol)
+
+    def tick(self):
+        now = time.time()
+        if self.playing:
+            self.seek(self.position
+                      + (now - self.last_tick) * self.SPEEDS[self.speed])
+            if self.position >= self.solve.duration:
+                self.playing = False
+        self.last_tick = now
+        self.show_status()
+        self.frame = self.call_later(self.FRAME, self.tick)
+
+    async def run(self):
+        duration = self.solve.duration
+        self.show()
+        self.start_input()
+        self.last_tick = time.time()
+        self.tick()
+
+        try:
+            while True:
+                keypress = await self.next_key()
+                target = self.position
+                if keypress == chr(17) or keypress in ('q', 'Q'):
+                    break
+                elif keypress == ' ':
+                    self.playing = not self.playing
+                    if self.playing and self.position >= duration:
+                        target = 0
+                elif keypress in ('+', '='):
+                    self.speed = min(self.speed + 1, len(self.SPEEDS) - 1)
+                elif keypress == '-':
+                    self.speed = max(self.speed - 1, 0)
+                elif keypress.name == 'KEY_LEFT':
+                    target -= 10
+                elif keypress.name == 'KEY_RIGHT':
+                    target += 10
+                elif keypress.name == 'KEY_DOWN':
+                    target -= 60
+                elif keypress.name == 'KEY_UP':
+                    target += 60
+                elif keypress.name == 'KEY_HOME':
+                    target = 0
+                elif keypress.name == 'KEY_END':
+                    target = duration
+                elif keypress.isdigit():
+                    target = duration * int(keypress) / 10
+
+                if target != self.position:
+                    self.seek(target)
+                if self.position >= duration:
+                    self.playing = False
+                self.show_status()
+        finally:
+            self.frame.cancel()
+            self.stop_input()
+
+
 def small_nums(number):
     small_num = ""
     num_dict = {"1": "₁", "2": "₂", "3": "₃", "4": "₄", "5": "₅",
@@ -677,46 +2107,60 @@ def encircle(letter):
     return circle_dict[letter]
 
 
-def main():
+def read_version():
     version_dir = os.path.abspath(os.path.dirname((__file__)))
     version_file = os.path.join(version_dir, 'version')
     with open(version_file) as f:
-        version = f.read().strip()
+        return f.read().strip()
 
-    parser = argparse.ArgumentParser(
-            prog='cursewords',
-            description="""A terminal-based crossword puzzle solving interface.""")
-
-    parser.add_argument('filename', metavar='PUZfile',
-            help="""path of puzzle file in the AcrossLite .puz format""")
-    parser.add_argument('--downs-only', action='store_true',
-            help="""displays only the down clues""")
-    parser.add_argument('--version', action='version', version=version)
-
-    args = parser.parse_args()
-    filename = args.filename
-    downs_only = args.downs_only
-
-    try:
-        puzfile = puz.read(filename)
-    except:
-        sys.exit("Unable to parse {} as a .puz file.".format(filename))
-
-    term = Terminal()
-
-    grid_x = 2
-    grid_y = 4
-
-    grid = Grid(grid_x, grid_y, term)
-    grid.load(puzfile)
 
-    puzzle_width = max(4 * grid.column_count, 40)
-    puzzle_height = 2 * grid.row_count
+def read_puzzle(filename):
+    """Return a puzzle file or pack member, unlocked, and its key."""
+    # Raises ValueError with a message for the user.
+    if pack.is_member(filename):
+        try:
+            puzfile = pack.read_member(filename)
+        except KeyError:
+            raise ValueError("There's no puzzle {} in {}.".format(
+                *reversed(pack.split_member(filename))))
+        except (OSError, ValueError) as e:
+            raise ValueError("Unable to read {}: {}".format(filename, e))
+    else:
+        try:
+            puzfile = puz.read(filename)
+        except puz.PuzzleFormatError as e:
+            message = "Unable to parse {} as a .puz file: {}".format(
+                    filename, e.message)
+            if 'checksum' in e.message:
+                message += ("\nIf nothing else is damaged, `cursewords "
+                            "verify --repair {}` can fix it.".format(filename))
+            raise ValueError(message)
+        except Exception:
+            raise ValueError(
+                    "Unable to parse {} as a .puz file.".format(filename))
+
+    # Checking, revealing and noticing a finished puzzle all need the
+    # real solution, so scrambled puzzles are unlocked first. Keys aren't
+    # cached for puzzles in a pack, whose ids change when it's rebuilt.
+    lock_key = unlock.unlock(
+            puzfile, None if pack.is_member(filename) else filename)
+    return puzfile, lock_key
+
+
+def layout_problem(term, grid, clue_pane=False):
+    """Return why the puzzle can't be shown in this terminal, or None."""
+    grid_x, grid_y = grid.grid_x, grid.grid_y
+    puzzle_width = max(grid.cell_width * grid.column_count, 40)
+    puzzle_height = grid.cell_height * grid.row_count
 
     min_width = (puzzle_width
                 + grid_x
                 + 2) # a little breathing room
 
+    pane_x = grid_x + grid.cell_width * grid.column_count + 4
+    if clue_pane:
+        min_width = max(min_width, pane_x + 24)
+
     min_height = (puzzle_height
                  + grid_y # includes the top bar + timer
                  + 2 # padding above clues
@@ -737,16 +2181,33 @@ def main():
         it.""".format(
             grid.column_count, grid.row_count,
             ' and '.join(necessary_resize)))
-        sys.exit(' '.join(exit_text.splitlines()))
+        if not grid.compact:
+            exit_text += "\nThe --compact layout needs less room."
+        return ' '.join(exit_text.splitlines())
 
     if grid.puzfile.has_rebus():
         exit_text = textwrap.dedent("""\
         This puzzle contains features not yet supported
         by cursewords. Sorry about that!""")
-        sys.exit(' '.join(exit_text.splitlines()))
+        return ' '.join(exit_text.splitlines())
 
-    print(term.enter_fullscreen())
-    print(term.clear())
+    return None
+
+
+def toolbar_commands(bindings):
+    return [(bindings.label(command), command.replace('-', ' '))
+            for command in ['quit', 'save', 'pause', 'check', 'reveal',
+                            'go-to', 'clear', 'reset']
+            if bindings.label(command)]
+
+
+def draw_screen(term, grid, version, commands, clue_pane=False,
+                downs_only=False):
+    """Draw the grid, headline and toolbar."""
+    grid_x, grid_y = grid.grid_x, grid.grid_y
+    puzzle_width = max(grid.cell_width * grid.column_count, 40)
+    puzzle_height = grid.cell_height * grid.row_count
+    pane_x = grid_x + grid.cell_width * grid.column_count + 4
 
     grid.draw()
     grid.number()
@@ -768,15 +2229,6 @@ def main():
         print(term.dim(term.reverse(headline)))
 
     toolbar = ''
-    commands = [("^Q", "quit"),
-                ("^S", "save"),
-                ("^P", "pause"),
-                ("^C", "check"),
-                ("^R", "reveal"),
-                ("^G", "go to"),
-                ("^X", "clear"),
-                ("^Z", "reset"),]
-
     if term.width >= 15 * len(commands):
         for shortcut, action in commands:
             shortcut = term.reverse(shortcut)
@@ -800,291 +2252,220 @@ def main():
     clue_width = min(int(1.3 * (puzzle_width) - grid_x),
                      term.width - 2 - grid_x)
 
+    pane = None
+    if clue_pane:
+        clue_width = min(clue_width, pane_x - grid_x - 2)
+        pane_height = grid.notification_area[0] - 1 - grid_y
+        pane = CluePane(grid, pane_x, grid_y,
+                        min(term.width - pane_x - 1, 60), pane_height,
+                        downs_only=downs_only)
+
     clue_wrapper = textwrap.TextWrapper(
             width=clue_width,
             max_lines=3,
             subsequent_indent=grid_x * ' ')
 
+    info_location = {'x': grid_x,
+                     'y': grid_y + puzzle_height + grid.cell_height}
+
+    return clue_wrapper, pane, info_location
+
+
+def host_main(argv):
+    # host subclasses Session, so it can only be imported once this
+    # module has finished loading.
+    from . import host
+    return host.main(argv)
+
+
+SUBCOMMANDS = {
+    'export': export.main,
+    'host': host_main,
+    'pack': pack.main,
+    'search': search.main,
+    'unpack': pack.unpack_main,
+    'verify': checksums.main,
+}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+
+    version = read_version()
+
+    parser = argparse.ArgumentParser(
+            prog='cursewords',
+            description="""A terminal-based crossword puzzle solving interface.""",
+            epilog="""Run `cursewords verify -h` for checking and repairing
+                      .puz file checksums.""")
+
+    parser.add_argument('filenames', metavar='PUZfile', nargs='*',
+            help="""path of puzzle file in the AcrossLite .puz format, or
+                    ARCHIVE#ID for a puzzle in a pack; several are opened
+                    in tabs""")
+    parser.add_argument('--downs-only', action='store_true',
+            help="""displays only the down clues""")
+    parser.add_argument('--clue-pane', action='store_true',
+            help="""lists every clue in a pane beside the grid""")
+    parser.add_argument('--compact', action='store_true',
+            help="""draws two columns per square without borders, to
+                    fit large grids in a smaller terminal""")
+    parser.add_argument('--autocheck', action='store_true',
+            help="""marks wrong letters as soon as they're entered""")
+    parser.add_argument('--serve', action='store_true',
+            help="""host the puzzle for co-op solving instead of
+                    opening it""")
+    parser.add_argument('--address', default=coop.DEFAULT_ADDRESS,
+            help="""host:port or unix:path the co-op server listens on
+                    (default: %(default)s)""")
+    parser.add_argument('--join', metavar='ADDRESS',
+            help="""join a co-op solve hosted at host:port or unix:path""")
+    parser.add_argument('--record', metavar='PATH',
+            help="""record every change, with its time, to a file that
+                    --replay can play back""")
+    parser.add_argument('--replay', metavar='PATH',
+            help="""play back a solve recorded with --record instead of
+                    solving""")
+    parser.add_argument('--wordlist', metavar='PATH',
+            default=wordlist.default_wordlist(),
+            help="""word list used for ctrl+w fill suggestions, one word
+                    per line (default: %(default)s)""")
+    parser.add_argument('--keymap', metavar='PATH',
+            default=keymap.DEFAULT_KEYMAP,
+            help="""file of key bindings to use instead of the defaults
+                    (default: %(default)s)""")
+    parser.add_argument('--tab-cache', metavar='MB', type=float, default=64,
+            help="""memory to spend keeping other open puzzles ready to
+                    switch to; beyond it, only their progress is kept
+                    (default: %(default)s)""")
+    parser.add_argument('--version', action='version', version=version)
+
+    args = parser.parse_args()
+    filenames = args.filenames
+    filename = filenames[0] if filenames else None
+    if len(filenames) > 1 and (args.serve or args.join or args.record or
+                               args.replay):
+        parser.error("--serve, --join, --record and --replay take one "
+                     "puzzle file")
+    downs_only = args.downs_only
+    peer = None
+
+    if args.join:
+        try:
+            peer, puzfile = coop.join(args.join)
+        except (OSError, ValueError) as e:
+            sys.exit("Unable to join co-op solve at {}: {}".format(
+                args.join, e))
+        lock_key = unlock.unlock(puzfile)
+    elif not filename:
+        parser.error("a puzzle file is required")
+    else:
+        try:
+            puzfile, lock_key = read_puzzle(filename)
+        except ValueError as e:
+            sys.exit(str(e))
+
+    if args.serve:
+        grid = Grid(0, 0, None)
+        grid.load(puzfile)
+        grid.lock_key = lock_key
+        try:
+            asyncio.run(coop.Server(grid, filename).serve(args.address))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    try:
+        bindings = keymap.Keymap.load(args.keymap)
+    except (OSError, ValueError) as e:
+        sys.exit("Unable to read key bindings: {}".format(e))
+
+    term = Terminal()
+
+    if len(filenames) > 1:
+        tabs = Tabs(filenames, term, version, bindings,
+                    cache_size=int(args.tab_cache * 2**20),
+                    compact=args.compact, clue_pane=args.clue_pane,
+                    downs_only=downs_only, autocheck=args.autocheck,
+                    wordlist_path=args.wordlist)
+        try:
+            session = tabs.build(0, puzfile, lock_key)
+        except ValueError as e:
+            sys.exit(str(e))
+
+        print(term.enter_fullscreen())
+        with term.raw(), term.hidden_cursor():
+            asyncio.run(tabs.run(session))
+        print(term.exit_fullscreen())
+        return
+
+    grid_x = 2
+    grid_y = 4
+
+    grid = Grid(grid_x, grid_y, term, compact=args.compact)
+    grid.load(puzfile)
+    grid.lock_key = lock_key
+
+    solve = None
+    if args.replay:
+        try:
+            solve = recording.Recording(args.replay)
+        except (OSError, ValueError) as e:
+            sys.exit("Unable to read recording {}: {}".format(args.replay, e))
+        if (solve.width, solve.height) != (grid.column_count, grid.row_count):
+            sys.exit("{} is a recording of a different puzzle.".format(
+                args.replay))
+
+    problem = layout_problem(term, grid, clue_pane=args.clue_pane)
+    if problem:
+        sys.exit(problem)
+
+    print(term.enter_fullscreen())
+    print(term.clear())
+
+    if solve:
+        commands = [("space", "play/pause"),
+                    ("+/-", "speed"),
+                    ("←/→", "seek 10s"),
+                    ("↑/↓", "seek 1m"),
+                    ("0-9", "seek to 0-90%"),
+                    ("q", "quit"),]
+    else:
+        commands = toolbar_commands(bindings)
+
+    clue_wrapper, clue_pane, info_location = draw_screen(
+            term, grid, version, commands, clue_pane=args.clue_pane,
+            downs_only=downs_only)
+
     start_pos = grid.across_words[0][0]
     cursor = Cursor(start_pos, "across", grid)
 
-    old_word = []
-    old_position = start_pos
-    keypress = ''
-    puzzle_paused = False
-    puzzle_complete = False
-    modified_since_save = False
-    to_quit = False
+    if solve:
+        timer = Timer(grid, is_running=False, active=False)
+        with term.raw(), term.hidden_cursor():
+            asyncio.run(Replay(grid, timer, solve).run())
+        print(term.exit_fullscreen())
+        return
 
     timer = Timer(grid, starting_seconds=int(grid.start_time),
                   is_running=True, active=bool(int(grid.timer_active)))
-    timer.start()
-
-    info_location = {'x': grid_x, 'y': grid_y + 2 * grid.row_count + 2}
 
-    with term.raw(), term.hidden_cursor():
-        while not to_quit:
-            # First up we draw all the necessary stuff. If the current word
-            # is different from the word the last time through the loop:
-            if cursor.current_word() is not old_word:
-                overwrite_mode = False
-                for pos in old_word:
-                    grid.draw_cell(pos)
-                for pos in cursor.current_word():
-                    grid.draw_highlighted_cell(pos)
-
-            # Draw the clue for the new word:
-                if cursor.direction == "across":
-                    num_index = grid.across_words.index(
-                            cursor.current_word())
-                    clue = grid.across_clues[num_index]
-                    if downs_only:
-                        clue = "—"
-                elif cursor.direction == "down":
-                    num_index = grid.down_words_grouped.index(
-                            cursor.current_word())
-                    clue = grid.down_clues[num_index]
-
-                num = str(grid.cells.get(cursor.current_word()[0]).number)
-                compiled_clue = (num + " " + cursor.direction.upper()
-                                + ": " + clue)
-                wrapped_clue = clue_wrapper.wrap(compiled_clue)
-                wrapped_clue += [''] * (3 - len(wrapped_clue))
-                wrapped_clue = [line + term.clear_eol for line in wrapped_clue]
-
-                # This is fun: since we're in raw mode, \n isn't sufficient to
-                # return the printing location to the first column. If you 
-                # don't also have \r,
-                # it
-                #    prints
-                #           like
-                #                this after each newline
-                print(term.move(info_location['y'], info_location['x'])
-                        + '\r\n'.join(wrapped_clue))
-
-            # Otherwise, just draw the old square now that it's not under
-            # the cursor
-            else:
-                grid.draw_highlighted_cell(old_position)
-
-            current_cell = grid.cells.get(cursor.position)
-            value = current_cell.entry
-            grid.draw_cursor_cell(cursor.position)
-
-            # Check if the puzzle is complete!
-            if not puzzle_complete and all(grid.cells.get(pos).is_correct()
-                    for pos in grid.cells):
-                puzzle_complete = True
-                with term.location(x=grid_x, y=2):
-                    print(term.reverse("You've completed the puzzle!"),
-                            term.clear_eol)
-                timer.show_time()
-                timer.active = False
-
-            blank_cells_remaining = any(grid.cells.get(pos).is_blankish()
-                                        for pos in grid.cells)
-
-            # Where the magic happens: get key input
-            keypress = term.inkey()
-
-            old_position = cursor.position
-            old_word = cursor.current_word()
-
-            # ctrl-q
-            if keypress == chr(17):
-                to_quit = grid.confirm_quit(modified_since_save)
-                if not to_quit:
-                    grid.send_notification("Quit command canceled.")
-
-            # ctrl-s
-            elif keypress == chr(19):
-                grid.puzfile.extensions[puz.Extensions.Timer] = timer.save_format()
-                grid.save(filename)
-                modified_since_save = False
-
-            # ctrl-p
-            elif keypress == chr(16) and not puzzle_complete:
-                if timer.is_running:
-                    timer.pause()
-                    grid.draw()
-
-                    with term.location(**info_location):
-                        print('\r\n'.join(['PUZZLE PAUSED' + term.clear_eol,
-                                           term.clear_eol,
-                                           term.clear_eol]))
-
-                    puzzle_paused = True
-
-                else:
-                    timer.unpause()
-                    grid.fill()
-                    old_word = []
-
-                    puzzle_paused = False
-
-            # ctrl-z
-            elif keypress == chr(26):
-                confirm = grid.confirm_reset()
-                if confirm:
-                    grid.send_notification("Puzzle reset.")
-                    for pos in grid.cells:
-                        cell = grid.cells.get(pos)
-                        if cell.is_letter():
-                            cell.clear()
-                            cell.corrected = False
-                            cell.revealed = False
-                            grid.draw_cell(pos)
-                    timer.starting_seconds = timer.time_passed = 0
-                    timer.start_time = time.time()
-                    timer.show_time()
-                    modified_since_save = True
-                    if not puzzle_paused:
-                        old_word = []
-                else:
-                    grid.send_notification("Reset command canceled.")
-
-            # If the puzzle is paused, skip all the rest of the logic
-            elif puzzle_paused:
-                continue
+    recorder = None
+    if args.record:
+        try:
+            recorder = recording.Recorder(args.record, grid, timer)
+        except OSError as e:
+            sys.exit("Unable to record to {}: {}".format(args.record, e))
 
-            # ctrl-c
-            elif keypress == chr(3):
-                group = grid.get_notification_input(
-                        "Check (l)etter, (w)ord, or (p)uzzle?",
-                        chars=1)
-                scope = ''
-                if group.lower() == 'l':
-                    scope = 'letter'
-                    grid.check_cell(cursor.position)
-                elif group.lower() == 'w':
-                    scope = 'word'
-                    grid.check_cells(cursor.current_word())
-                elif group.lower() == 'p':
-                    scope = 'puzzle'
-                    grid.check_cells(grid.cells)
-
-                if scope:
-                    grid.send_notification("Checked {scope} for errors.".
-                            format(scope=scope))
-                else:
-                    grid.send_notification("No valid input entered.")
-
-                old_word = []
-
-            # ctrl-g
-            elif keypress == chr(7):
-                cursor.go_to_numbered_square()
-
-            # ctrl-x
-            elif keypress == chr(24):
-                confirm = grid.confirm_clear()
-                if confirm:
-                    grid.send_notification("Puzzle cleared.")
-                    for pos in grid.cells:
-                        cell = grid.cells.get(pos)
-                        if cell.is_letter():
-                            cell.clear()
-                            grid.draw_cell(pos)
-                    old_word = []
-                    modified_since_save = True
-                else:
-                    grid.send_notification("Clear command canceled.")
-
-
-            # ctrl-r
-            elif keypress == chr(18):
-                group = grid.get_notification_input(
-                        "Reveal (l)etter, (w)ord, or (p)uzzle?",
-                        chars=1)
-                scope = ''
-                if group.lower() == 'l':
-                    scope = 'letter'
-                    grid.reveal_cell(cursor.position)
-                elif group.lower() == 'w':
-                    scope = 'word'
-                    grid.reveal_cells(cursor.current_word())
-                elif group.lower() == 'p':
-                    scope = 'puzzle'
-                    grid.reveal_cells(grid.cells)
-
-                if scope:
-                    grid.send_notification("Revealed answers for {scope}.".
-                            format(scope=scope))
-                else:
-                    grid.send_notification("No valid input entered.")
-
-                old_word = []
-
-            # Letter entry
-            elif not puzzle_complete and keypress.isalnum():
-                if not current_cell.is_blankish():
-                    overwrite_mode = True
-                current_cell.entry = keypress.upper()
-
-                if current_cell.marked_wrong:
-                    current_cell.marked_wrong = False
-                    current_cell.corrected = True
-                modified_since_save = True
-                cursor.advance_within_word(overwrite_mode, wrap_mode=True)
-
-            # Delete key
-            elif not puzzle_complete and keypress.name == 'KEY_DELETE':
-                current_cell.clear()
-                overwrite_mode = True
-                modified_since_save = True
-                cursor.retreat_within_word(end_placement=True)
-
-            # Navigation
-            elif keypress.name in ['KEY_TAB'] and current_cell.is_blankish():
-                cursor.advance_to_next_word(blank_placement=True)
-
-            elif keypress.name in ['KEY_TAB'] and not current_cell.is_blankish():
-                cursor.advance_within_word(overwrite_mode=False)
-
-            elif keypress.name in ['KEY_PGDOWN']:
-                cursor.advance_to_next_word()
-
-            elif keypress.name in ['KEY_BTAB']:
-                cursor.retreat_within_word(blank_placement=True)
-
-            elif keypress.name in ['KEY_PGUP']:
-                cursor.retreat_to_previous_word()
-
-            elif (keypress.name == 'KEY_ENTER' or keypress == ' ' or
-                    (cursor.direction == "across" and
-                        keypress.name in ['KEY_DOWN', 'KEY_UP']) or
-                    (cursor.direction == "down" and
-                        keypress.name in ['KEY_LEFT', 'KEY_RIGHT'])):
-
-                cursor.switch_direction()
-                if not cursor.current_word():
-                    cursor.switch_direction()
-
-            elif ((cursor.direction == "across" and
-                        keypress.name == 'KEY_RIGHT') or
-                    (cursor.direction == "down" and
-                        keypress.name == 'KEY_DOWN')):
-
-                cursor.advance()
-
-            elif ((cursor.direction == "across" and
-                        keypress.name == 'KEY_LEFT') or
-                    (cursor.direction == "down" and
-                        keypress.name == 'KEY_UP')):
-
-                cursor.retreat()
-
-            elif keypress in ['}', ']']:
-                cursor.advance_perpendicular()
-                if (keypress == '}' and blank_cells_remaining):
-                    while not grid.cells.get(cursor.position).is_blankish():
-                        cursor.advance_perpendicular()
+    session = Session(grid, cursor, timer, filename,
+                      clue_wrapper, info_location, downs_only=downs_only,
+                      peer=peer, wordlist_path=args.wordlist,
+                      clue_pane=clue_pane, autocheck=args.autocheck,
+                      recorder=recorder, bindings=bindings)
 
-            elif keypress in ['{', '[']:
-                cursor.retreat_perpendicular()
-                if (keypress == '{' and blank_cells_remaining):
-                    while not grid.cells.get(cursor.position).is_blankish():
-                        cursor.retreat_perpendicular()
+    with term.raw(), term.hidden_cursor():
+        asyncio.run(session.run())
 
     print(term.exit_fullscreen())
 
@@ -0,0 +1,245 @@
+import argparse
+import functools
+import html
+import multiprocessing
+import os
+import sys
+import textwrap
+
+import puz
+
+from . import chars
+from . import cursewords
+from .checksums import find_puzzles
+
+FORMATS = {'text': '.txt', 'svg': '.svg', 'html': '.html'}
+
+# SVG geometry, in pixels.
+CELL = 32
+MARGIN = 8
+CLUE_COLUMN = 300
+CLUE_WRAP = 42
+LINE = 16
+
+
+def load_grid(path):
+    grid = cursewords.Grid(0, 0, None)
+    grid.load(puz.read(path))
+    grid.number()
+    return grid
+
+
+def clue_lists(grid):
+    """Return (across, down), each a list of (number, clue)."""
+    across = [(grid.cells.get(word[0]).number, clue)
+              for word, clue in zip(grid.across_words, grid.across_clues)]
+    down = [(grid.cells.get(word[0]).number, clue)
+            for word, clue in zip(grid.down_words_grouped, grid.down_clues)]
+    return across, down
+
+
+def cell_value(cell, filled):
+    if filled and not cell.is_blank():
+        return cell.entry
+    return ' '
+
+
+def to_text(grid, filled=False):
+    # Lay the grid out exactly as the terminal does, on a character canvas.
+    rows = [grid.get_top_row()]
+    for i in range(grid.row_count):
+        rows.append(grid.get_middle_row())
+        if i < grid.row_count - 1:
+            rows.append(grid.get_divider_row())
+    rows.append(grid.get_bottom_row())
+    canvas = [list(row) for row in rows]
+
+    for position, cell in grid.cells.items():
+        y, x = grid.to_term(position)
+        if cell.is_block():
+            canvas[y][x - 1:x + 2] = chars.squareblock
+        else:
+            value = cell_value(cell, filled)
+            canvas[y][x] = cursewords.encircle(value) if cell.circled else value
+        if cell.number:
+            small = cursewords.small_nums(cell.number)
+            canvas[y - 1][x - 1:x - 1 + len(small)] = small
+
+    lines = ['{} - {}'.format(grid.title, grid.author), '']
+    lines += [''.join(row) for row in canvas]
+
+    for heading, clues in zip(('ACROSS', 'DOWN'), clue_lists(grid)):
+        lines += ['', heading]
+        for number, clue in clues:
+            lines += textwrap.wrap('{}. {}'.format(number, clue), width=72,
+                                   initial_indent=' ' * (3 - len(str(number))),
+                                   subsequent_indent=' ' * 5)
+    return '\n'.join(lines) + '\n'
+
+
+def svg_grid(grid, filled=False):
+    """Return the SVG elements for the grid, offset by MARGIN."""
+    elements = []
+    for (col, row), cell in grid.cells.items():
+        x, y = MARGIN + col * CELL, MARGIN + row * CELL
+        fill = 'black' if cell.is_block() else 'white'
+        elements.append('<rect x="{}" y="{}" width="{}" height="{}" '
+                        'fill="{}" stroke="black"/>'.format(
+                            x, y, CELL, CELL, fill))
+        if cell.circled:
+            elements.append('<circle cx="{}" cy="{}" r="{}" fill="none" '
+                            'stroke="gray"/>'.format(
+                                x + CELL / 2, y + CELL / 2, CELL / 2 - 1))
+        if cell.number:
+            elements.append('<text x="{}" y="{}" font-size="9">{}</text>'
+                            .format(x + 2, y + 10, cell.number))
+        value = cell_value(cell, filled)
+        if cell.is_letter() and value != ' ':
+            elements.append('<text x="{}" y="{}" font-size="20" '
+                            'text-anchor="middle">{}</text>'.format(
+                                x + CELL / 2, y + CELL - 7,
+                                html.escape(value)))
+
+    width, height = grid.column_count * CELL, grid.row_count * CELL
+    elements.append('<rect x="{}" y="{}" width="{}" height="{}" fill="none" '
+                    'stroke="black" stroke-width="2"/>'.format(
+                        MARGIN, MARGIN, width, height))
+    return elements
+
+
+def to_svg(grid, filled=False):
+    elements = svg_grid(grid, filled)
+    grid_width = grid.column_count * CELL + 2 * MARGIN
+    grid_height = grid.row_count * CELL + 2 * MARGIN
+
+    # Clues go in two columns to the right of the grid.
+    bottom = grid_height
+    for n, (heading, clues) in enumerate(zip(('Across', 'Down'),
+                                             clue_lists(grid))):
+        x = grid_width + MARGIN + n * CLUE_COLUMN
+        y = MARGIN + LINE
+        elements.append('<text x="{}" y="{}" font-size="13" '
+                        'font-weight="bold">{}</text>'.format(x, y, heading))
+        for number, clue in clues:
+            lines = textwrap.wrap('{} {}'.format(number, clue),
+                                  width=CLUE_WRAP, subsequent_indent='   ')
+            for line in lines:
+                y += LINE
+                elements.append('<text x="{}" y="{}" font-size="12" '
+                                'xml:space="preserve">{}</text>'.format(
+                                    x, y, html.escape(line)))
+        bottom = max(bottom, y + MARGIN)
+
+    width = grid_width + 2 * CLUE_COLUMN + MARGIN
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="{w}" '
+            'height="{h}" viewBox="0 0 {w} {h}" font-family="sans-serif">\n'
+            '<title>{title}</title>\n{body}\n</svg>\n'.format(
+                w=width, h=bottom, title=html.escape(grid.title),
+                body='\n'.join(elements)))
+
+
+def to_html(grid, filled=False):
+    width = grid.column_count * CELL + 2 * MARGIN
+    height = grid.row_count * CELL + 2 * MARGIN
+    svg = ('<svg xmlns="http://www.w3.org/2000/svg" width="{w}" '
+           'height="{h}" font-family="sans-serif">\n{body}\n</svg>'.format(
+               w=width, h=height, body='\n'.join(svg_grid(grid, filled))))
+
+    lists = []
+    for heading, clues in zip(('Across', 'Down'), clue_lists(grid)):
+        items = '\n'.join('<li value="{}">{}</li>'.format(
+                              number, html.escape(clue))
+                          for number, clue in clues)
+        lists.append('<section>\n<h2>{}</h2>\n<ol>\n{}\n</ol>\n'
+                     '</section>'.format(heading, items))
+
+    return """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; }}
+main {{ display: flex; gap: 2em; align-items: flex-start; }}
+section {{ max-width: 20em; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p>{author}</p>
+<main>
+{svg}
+{lists}
+</main>
+</body>
+</html>
+""".format(title=html.escape(grid.title), author=html.escape(grid.author),
+           svg=svg, lists='\n'.join(lists))
+
+
+RENDERERS = {'text': to_text, 'svg': to_svg, 'html': to_html}
+
+
+def export_file(path, formats, filled, out_dir):
+    """Render one puzzle; return (path, written paths, error message)."""
+    try:
+        grid = load_grid(path)
+    except (OSError, ValueError, puz.PuzzleFormatError) as e:
+        return path, [], str(getattr(e, 'message', e)) or "unreadable"
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    directory = out_dir or os.path.dirname(path)
+    written = []
+    try:
+        for name in formats:
+            out_path = os.path.join(directory, stem + FORMATS[name])
+            with open(out_path, 'w', encoding='utf-8') as f:
+                f.write(RENDERERS[name](grid, filled))
+            written.append(out_path)
+    except OSError as e:
+        return path, written, str(e)
+    return path, written, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            prog='cursewords export',
+            description="""Renders puzzles to plain text, SVG or HTML for
+                           printing or publishing.""")
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+            help="""puzzle files, or directories to search for them""")
+    parser.add_argument('-f', '--format', dest='formats',
+            action='append', choices=sorted(FORMATS),
+            help="""output format, which may be given more than once
+                    (default: text)""")
+    parser.add_argument('--filled', action='store_true',
+            help="""include the letters entered so far instead of a
+                    blank grid""")
+    parser.add_argument('-o', '--output', metavar='DIR',
+            help="""directory for the rendered files (default: next to
+                    each puzzle)""")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help="""number of worker processes (default: one per CPU)""")
+
+    args = parser.parse_args(argv)
+    formats = args.formats or ['text']
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    worker = functools.partial(export_file, formats=formats,
+                               filled=args.filled, out_dir=args.output)
+    exported = failed = 0
+
+    with multiprocessing.Pool(args.jobs) as pool:
+        for path, written, error in pool.imap_unordered(
+                worker, find_puzzles(args.paths), chunksize=8):
+            if error:
+                failed += 1
+                print("{}: {}".format(path, error), file=sys.stderr)
+            else:
+                exported += 1
+                print('\n'.join(written))
+
+    print("{} exported, {} failed.".format(exported, failed),
+          file=sys.stderr)
+    return 1 if failed else 0
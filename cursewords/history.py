@@ -0,0 +1,100 @@
+import struct
+
+# cell index, old entry, new entry, flags
+RECORD = struct.Struct('<HccB')
+
+# The flags byte holds the old markup in its low three bits, the new
+# markup in the next three, and marks the first record of each group.
+MARKUP_BITS = 7
+GROUP_START = 64
+
+DEFAULT_CAPACITY = 16384
+
+
+def pack_markup(md):
+    # Only corrected, marked_wrong and revealed (16, 32 and 64) change
+    # while solving; circles are part of the puzzle.
+    return (md >> 4) & MARKUP_BITS
+
+
+def unpack_markup(bits):
+    return bits << 4
+
+
+class History:
+    """A bounded log of cell changes for undo and redo.
+
+    Each changed cell costs one five-byte record in a fixed-size ring
+    buffer. Changes made by a single command are stored as one group and
+    undone together. When the buffer fills, the oldest groups are
+    dropped whole.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+
+        # Absolute record numbers: the oldest record kept, the end of
+        # the records currently applied, and the end of the redo tail.
+        self.first = 0
+        self.current = 0
+        self.last = 0
+
+    def read(self, i):
+        idx, old, new, flags = RECORD.unpack_from(
+                self.buffer, (i % self.capacity) * RECORD.size)
+        return idx, old.decode('latin-1'), new.decode('latin-1'), flags
+
+    def is_group_start(self, i):
+        return self.read(i)[3] & GROUP_START
+
+    def record(self, changes):
+        """Log a group of CellChanges."""
+        if not changes:
+            return
+
+        self.last = self.current
+        if len(changes) > self.capacity:
+            self.first = self.current = self.last
+            return
+
+        while self.last + len(changes) - self.first > self.capacity:
+            self.first += 1
+            while self.first < self.last and not self.is_group_start(
+                    self.first):
+                self.first += 1
+
+        for n, change in enumerate(changes):
+            flags = (pack_markup(change.old_markup) |
+                     pack_markup(change.markup) << 3)
+            if n == 0:
+                flags |= GROUP_START
+            RECORD.pack_into(self.buffer,
+                             (self.last % self.capacity) * RECORD.size,
+                             change.index,
+                             change.old_entry.encode('latin-1', 'replace'),
+                             change.entry.encode('latin-1', 'replace'),
+                             flags)
+            self.last += 1
+        self.current = self.last
+
+    def undo(self):
+        """Step back one group; return its cells' old (idx, entry, md)."""
+        changes = []
+        while self.current > self.first:
+            self.current -= 1
+            idx, old, _, flags = self.read(self.current)
+            changes.append((idx, old, unpack_markup(flags & MARKUP_BITS)))
+            if flags & GROUP_START:
+                break
+        return changes
+
+    def redo(self):
+        """Step forward one group; return its cells' new (idx, entry, md)."""
+        changes = []
+        while self.current < self.last:
+            idx, _, new, flags = self.read(self.current)
+            if changes and flags & GROUP_START:
+                break
+            changes.append((idx, new, unpack_markup(flags >> 3 & MARKUP_BITS)))
+            self.current += 1
+        return changes
@@ -0,0 +1,409 @@
+import argparse
+import asyncio
+import codecs
+import collections
+import contextvars
+import os
+import re
+import resource
+import sys
+import time
+
+import puz
+from blessed import Terminal
+from blessed.keyboard import Keystroke
+
+from . import coop
+from . import cursewords
+from . import keymap
+from . import unlock
+from .checksums import find_puzzles
+from .coop import log
+
+DEFAULT_ADDRESS = '127.0.0.1:7818'
+DEFAULT_STATE = os.path.join(
+        os.environ.get('XDG_DATA_HOME')
+        or os.path.expanduser('~/.local/share'), 'cursewords', 'host')
+
+# Undo history per session, in changed squares.
+HISTORY_CAPACITY = 1024
+
+# Seconds to wait for a new connection's header line.
+HEADER_TIMEOUT = 10
+
+# Latencies kept per session for reporting.
+LATENCY_SAMPLES = 1000
+
+# A user name is a directory under the state directory, so it can't be
+# '.' or '..'.
+USER_NAME = re.compile(r"\w[\w.-]{0,31}")
+
+# The connection being served by the running task. Every print() and
+# everything written through the shared terminal goes to it.
+CONNECTION = contextvars.ContextVar('connection')
+
+
+class Connection:
+    """The terminal at the other end of one hosted session's socket.
+
+    Output is collected as it's printed and written to the socket once
+    the task that printed it yields, so a keystroke's whole redraw goes
+    out together. The time from a keystroke arriving to its redraw being
+    written is kept as the session's latency.
+    """
+    def __init__(self, writer, width, height):
+        self.writer = writer
+        self.width = width
+        self.height = height
+        self.output = []
+        self.flush_scheduled = False
+        self.bytes_written = 0
+
+        self.key_received = None
+        self.key_handled = False
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def write(self, text):
+        self.output.append(text)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        if self.output:
+            data = ''.join(self.output).encode()
+            self.output = []
+            if not self.writer.is_closing():
+                self.writer.write(data)
+            self.bytes_written += len(data)
+
+        if self.key_handled:
+            self.latencies.append(time.perf_counter() - self.key_received)
+            self.key_received = None
+            self.key_handled = False
+
+    def latency(self):
+        """Return the median and worst latency, in milliseconds."""
+        if not self.latencies:
+            return 0, 0
+        ordered = sorted(self.latencies)
+        return ordered[len(ordered) // 2] * 1000, ordered[-1] * 1000
+
+
+class RoutedStream:
+    """Stands in for sys.stdout, passing writes to the current connection."""
+    def __init__(self, default):
+        self.default = default
+
+    def write(self, text):
+        return CONNECTION.get(self.default).write(text)
+
+    def flush(self):
+        connection = CONNECTION.get(None)
+        if connection is None:
+            self.default.flush()
+
+
+class HostTerminal(Terminal):
+    """One terminal shared by every session, sized by the current one.
+
+    A blessed Terminal is about 100 KB, so the sessions share this one;
+    its stream is a RoutedStream and its size is the connection's.
+    """
+    @property
+    def width(self):
+        connection = CONNECTION.get(None)
+        return connection.width if connection else super().width
+
+    @property
+    def height(self):
+        connection = CONNECTION.get(None)
+        return connection.height if connection else super().height
+
+
+class HostedSession(cursewords.Session):
+    """A Session whose keys come from, and screen goes to, a Connection."""
+    def __init__(self, connection, user, name, *args, **kwargs):
+        super().__init__(*args, history_size=HISTORY_CAPACITY, **kwargs)
+        self.connection = connection
+        self.user = user
+        self.name = name
+        self.started = time.monotonic()
+
+    def start_input(self):
+        pass
+
+    def stop_input(self):
+        pass
+
+    def feed(self, text):
+        if self.connection.key_received is None:
+            self.connection.key_received = time.perf_counter()
+        # The terminal is shared, so its buffer is filled and drained in
+        # one go. A zero escape delay keeps a lone escape from blocking
+        # every other session.
+        self.term.ungetch(text)
+        keypress = self.term.inkey(timeout=0, esc_delay=0)
+        while keypress:
+            self.events.put_nowait(keypress)
+            keypress = self.term.inkey(timeout=0, esc_delay=0)
+
+    async def handle_key(self, keypress):
+        await super().handle_key(keypress)
+        if self.connection.key_received is not None:
+            self.connection.key_handled = True
+
+    def save(self):
+        # The shared puzzle is left alone; the user's copy is written
+        # from a fresh one.
+        grid = self.grid
+        shared = grid.puzfile
+        grid.puzfile = puz.load(shared.tobytes())
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            return super().save()
+        finally:
+            grid.puzfile = shared
+
+    def memory(self):
+        """Estimate the bytes of state this session holds on its own."""
+        cells = self.grid.cells
+        size = sys.getsizeof(cells)
+        size += sum(sys.getsizeof(cell) for cell in cells.values())
+        size += sys.getsizeof(self.tally.status)
+        size += sys.getsizeof(self.history.buffer)
+        return size
+
+    def report(self):
+        median, worst = self.connection.latency()
+        return ("{} on {}: {:.0f} KB, {} KB sent, {:.1f} ms median and "
+                "{:.1f} ms worst key latency, {:.0f}s".format(
+                    self.user, self.name, self.memory() / 1024,
+                    self.connection.bytes_written // 1024, median, worst,
+                    time.monotonic() - self.started))
+
+
+class Host:
+    """Serves many independent solves from one process.
+
+    Each puzzle is loaded once, into a template grid whose words and
+    clues every session of that puzzle shares. A session keeps only its
+    own squares, cursor, timer and a small undo history, and saves to a
+    copy of the puzzle under the state directory.
+    """
+    def __init__(self, paths, state_dir=DEFAULT_STATE, compact=False,
+                 autocheck=False, bindings=None):
+        self.paths = {}
+        for path in find_puzzles(paths):
+            self.paths.setdefault(os.path.basename(path), path)
+        self.state_dir = state_dir
+        self.compact = compact
+        self.autocheck = autocheck
+        self.bindings = bindings or keymap.Keymap()
+        self.version = cursewords.read_version()
+
+        self.templates = {}
+        self.sessions = set()
+        self.term = HostTerminal('xterm-256color',
+                                 stream=RoutedStream(sys.stdout),
+                                 force_styling=True)
+
+    def template(self, name):
+        if name not in self.templates:
+            path = self.paths[name]
+            puzfile = puz.read(path)
+            grid = cursewords.Grid(0, 0, None)
+            key = unlock.unlock(puzfile, path)
+            grid.load(puzfile)
+            grid.lock_key = key
+            grid.number()
+            self.templates[name] = grid
+        return self.templates[name]
+
+    def progress(self, path, template):
+        """Return the user's saved copy of a puzzle, if it fits."""
+        try:
+            saved = puz.read(path)
+        except Exception:
+            return None
+        if ((saved.width, saved.height) !=
+                (template.column_count, template.row_count)):
+            return None
+        return saved
+
+    def parse_header(self, line):
+        # COLUMNS ROWS USER PUZZLE
+        fields = line.decode(errors='replace').split(None, 3)
+        if len(fields) != 4:
+            raise ValueError("expected COLUMNS ROWS USER PUZZLE")
+        width, height = int(fields[0]), int(fields[1])
+        user, name = fields[2], fields[3].strip()
+        if not USER_NAME.fullmatch(user):
+            raise ValueError("bad user name")
+        if name not in self.paths:
+            raise ValueError("no puzzle named {}; try one of: {}".format(
+                name, ', '.join(sorted(self.paths))))
+        return width, height, user, name
+
+    def save_path(self, user, name):
+        """Return where a user's copy of a puzzle is saved."""
+        state_dir = os.path.realpath(self.state_dir)
+        path = os.path.realpath(os.path.join(state_dir, user, name))
+        if os.path.commonpath([state_dir, path]) != state_dir:
+            raise ValueError("bad user name")
+        return path
+
+    async def handle(self, reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+            width, height, user, name = self.parse_header(line)
+            save_path = self.save_path(user, name)
+            template = self.template(name)
+        except (asyncio.TimeoutError, ValueError, OSError,
+                puz.PuzzleFormatError) as e:
+            writer.write("{}\r\n".format(e).encode())
+            writer.close()
+            return
+
+        connection = Connection(writer, width, height)
+        CONNECTION.set(connection)
+        term = self.term
+
+        grid = cursewords.Grid(2, 4, term, compact=self.compact)
+        grid.share(template, self.progress(save_path, template))
+
+        problem = cursewords.layout_problem(term, grid)
+        if problem:
+            print(problem, end='\r\n')
+            connection.flush()
+            writer.close()
+            return
+
+        print(term.enter_fullscreen())
+        print(term.clear())
+        clue_wrapper, _, info_location = cursewords.draw_screen(
+                term, grid, self.version,
+                cursewords.toolbar_commands(self.bindings))
+
+        cursor = cursewords.Cursor(grid.across_words[0][0], "across", grid)
+        timer = cursewords.Timer(grid, starting_seconds=int(grid.start_time),
+                                 is_running=True,
+                                 active=bool(int(grid.timer_active)))
+        session = HostedSession(connection, user, name, grid, cursor, timer,
+                                save_path, clue_wrapper, info_location,
+                                autocheck=self.autocheck,
+                                bindings=self.bindings)
+
+        self.sessions.add(session)
+        log("{} opened {} ({} sessions).".format(user, name,
+                                                 len(self.sessions)))
+        reading = asyncio.ensure_future(self.read_keys(reader, session))
+        try:
+            with term.hidden_cursor():
+                await session.run()
+            print(term.exit_fullscreen())
+        finally:
+            reading.cancel()
+            self.sessions.discard(session)
+            connection.flush()
+            writer.close()
+            log("{} closed {} ({} sessions): {}".format(
+                user, name, len(self.sessions), session.report()))
+
+    async def read_keys(self, reader, session):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        while True:
+            try:
+                data = await reader.read(4096)
+            except ConnectionError:
+                data = b''
+            if not data:
+                break
+            session.feed(decoder.decode(data))
+
+        # The other end went away; let the session finish.
+        session.to_quit = True
+        session.events.put_nowait(Keystroke(''))
+
+    def report(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        log("{} sessions of {} puzzles; {} MB peak memory.".format(
+            len(self.sessions), len(self.templates),
+            usage.ru_maxrss // 1024))
+        for session in sorted(self.sessions, key=lambda s: s.started):
+            log("  " + session.report())
+
+    async def report_forever(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if self.sessions:
+                self.report()
+
+    async def serve(self, address, report_interval=None):
+        inet, path = coop.parse_address(address)
+        if path:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, *inet)
+
+        log("Hosting {} puzzles on {}.".format(len(self.paths), address))
+        reporter = None
+        if report_interval:
+            reporter = asyncio.ensure_future(
+                    self.report_forever(report_interval))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if reporter:
+                reporter.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            prog='cursewords host',
+            description="""Hosts independent solves for many users in one
+                           process. Each connection starts with a line
+                           "COLUMNS ROWS USER PUZZLE" and is then a raw
+                           terminal.""")
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+            help="""puzzle files, or directories to search for them""")
+    parser.add_argument('--address', default=DEFAULT_ADDRESS,
+            help="""host:port or unix:path to listen on
+                    (default: %(default)s)""")
+    parser.add_argument('--state', metavar='DIR', default=DEFAULT_STATE,
+            help="""directory where each user's progress is saved
+                    (default: %(default)s)""")
+    parser.add_argument('--compact', action='store_true',
+            help="""use the compact layout for every session""")
+    parser.add_argument('--autocheck', action='store_true',
+            help="""mark wrong letters as soon as they're entered""")
+    parser.add_argument('--keymap', metavar='PATH',
+            default=keymap.DEFAULT_KEYMAP,
+            help="""file of key bindings for every session
+                    (default: %(default)s)""")
+    parser.add_argument('--report', metavar='SECONDS', type=float,
+            default=60,
+            help="""how often to log each session's memory and latency,
+                    or 0 for only when it ends (default: %(default)s)""")
+
+    args = parser.parse_args(argv)
+    try:
+        bindings = keymap.Keymap.load(args.keymap)
+    except (OSError, ValueError) as e:
+        parser.exit(1, "Unable to read key bindings: {}\n".format(e))
+
+    host = Host(args.paths, state_dir=args.state, compact=args.compact,
+                autocheck=args.autocheck, bindings=bindings)
+    if not host.paths:
+        parser.exit(1, "No puzzles found.\n")
+
+    sys.stdout = RoutedStream(sys.stdout)
+    try:
+        asyncio.run(host.serve(args.address, args.report))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout = sys.stdout.default
+    return 0
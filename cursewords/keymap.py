@@ -0,0 +1,147 @@
+import os
+
+DEFAULT_KEYMAP = os.path.expanduser('~/.config/cursewords/keys')
+
+DIRECTIONS = ('across', 'down')
+MODES = ('solving', 'paused', 'complete')
+
+# Commands that still work while the puzzle is paused, and commands that
+# stop working once it's complete.
+PAUSED_COMMANDS = {'quit', 'save', 'pause', 'reset', 'next-tab',
+                   'previous-tab'}
+EDITING_COMMANDS = {'pause', 'undo', 'redo', 'delete'}
+
+# key, command, and the direction it applies in (None for both)
+DEFAULT_BINDINGS = [
+    ('ctrl+q', 'quit', None),
+    ('ctrl+s', 'save', None),
+    ('ctrl+p', 'pause', None),
+    ('ctrl+z', 'reset', None),
+    ('ctrl+c', 'check', None),
+    ('ctrl+g', 'go-to', None),
+    ('ctrl+f', 'search', None),
+    ('ctrl+a', 'forced', None),
+    ('ctrl+w', 'suggest', None),
+    ('ctrl+u', 'undo', None),
+    ('ctrl+y', 'redo', None),
+    ('ctrl+x', 'clear', None),
+    ('ctrl+r', 'reveal', None),
+    ('ctrl+n', 'next-tab', None),
+    ('ctrl+b', 'previous-tab', None),
+    ('delete', 'delete', None),
+    ('backspace', 'delete', None),
+    ('tab', 'next-blank', None),
+    ('btab', 'previous-blank', None),
+    ('pgdown', 'next-word', None),
+    ('pgup', 'previous-word', None),
+    ('enter', 'switch-direction', None),
+    ('space', 'switch-direction', None),
+    ('right', 'advance', 'across'),
+    ('left', 'retreat', 'across'),
+    ('up', 'switch-direction', 'across'),
+    ('down', 'switch-direction', 'across'),
+    ('down', 'advance', 'down'),
+    ('up', 'retreat', 'down'),
+    ('left', 'switch-direction', 'down'),
+    ('right', 'switch-direction', 'down'),
+    (']', 'next-line', None),
+    ('}', 'next-line-blank', None),
+    ('[', 'previous-line', None),
+    ('{', 'previous-line-blank', None),
+]
+
+COMMANDS = {command for _, command, _ in DEFAULT_BINDINGS}
+
+# Bound to this, a key does nothing.
+UNBOUND = 'none'
+
+
+def key_name(keypress):
+    """Return the name a key is bound by, e.g. 'ctrl+q', 'tab' or 'a'."""
+    if keypress.is_sequence:
+        # blessed names these KEY_TAB, KEY_PGDOWN and so on.
+        return (keypress.name or '')[4:].lower()
+    char = str(keypress)
+    if char == ' ':
+        return 'space'
+    if len(char) == 1 and '\x01' <= char <= '\x1a':
+        return 'ctrl+' + chr(ord(char) + 96)
+    return char
+
+
+def allowed(command, mode):
+    if mode == 'paused':
+        return command in PAUSED_COMMANDS
+    if mode == 'complete':
+        return command not in EDITING_COMMANDS
+    return True
+
+
+class Keymap:
+    """The key bindings, with any changes from the user's keymap file.
+
+    The file has one binding per line: a key, a command, and optionally
+    the direction ('across' or 'down') it applies in. Binding a key to
+    'none' turns it off. Lines starting with '#' are ignored.
+    """
+    def __init__(self, bindings=DEFAULT_BINDINGS):
+        self.bindings = list(bindings)
+
+    @classmethod
+    def load(cls, path=DEFAULT_KEYMAP):
+        keymap = cls()
+        if path and os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    fields = line.split()
+                    if not fields or fields[0].startswith('#'):
+                        continue
+                    keymap.bind(*keymap.parse(fields, path, line_number))
+        return keymap
+
+    def parse(self, fields, path, line_number):
+        key, command, direction = (fields + [None])[:3]
+        if len(fields) not in (2, 3):
+            problem = "expected a key, a command and maybe a direction"
+        elif command not in COMMANDS and command != UNBOUND:
+            problem = "unknown command {}".format(command)
+        elif direction not in DIRECTIONS + (None,):
+            problem = "unknown direction {}".format(direction)
+        else:
+            return key, command, direction
+        raise ValueError("{}, line {}: {}".format(path, line_number, problem))
+
+    def bind(self, key, command, direction=None):
+        # A new binding replaces any old one for the same key, in the
+        # directions it covers.
+        directions = [direction] if direction else DIRECTIONS
+        bindings = []
+        for bound_key, bound_command, bound_direction in self.bindings:
+            if bound_key != key:
+                bindings.append((bound_key, bound_command, bound_direction))
+                continue
+            for kept in ([bound_direction] if bound_direction
+                         else DIRECTIONS):
+                if kept not in directions:
+                    bindings.append((bound_key, bound_command, kept))
+        self.bindings = bindings
+        if command != UNBOUND:
+            self.bindings.append((key, command, direction))
+
+    def table(self, handlers):
+        """Return {(key, direction, mode): handler} for dispatching keys."""
+        table = {}
+        for key, command, direction in self.bindings:
+            for bound_direction in ([direction] if direction else DIRECTIONS):
+                for mode in MODES:
+                    if allowed(command, mode):
+                        table[(key, bound_direction, mode)] = handlers[command]
+        return table
+
+    def label(self, command):
+        """Return a short label for the first key bound to a command."""
+        key = next((key for key, bound, _ in self.bindings
+                    if bound == command), None)
+        if key and key.startswith('ctrl+'):
+            return '^' + key[5:].upper()
+        return key
@@ -0,0 +1,401 @@
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+
+import puz
+
+from .checksums import find_puzzles
+
+MAGIC = b'CWPACK\x00\x02'
+
+# magic, puzzle count, offset of the index, offset of the name index
+HEADER = struct.Struct('<8sIQQ')
+
+# The index is one record offset per puzzle, in id order; the name index
+# is the ids again, sorted by puzzle name.
+OFFSET = struct.Struct('<Q')
+ID = struct.Struct('<I')
+
+# width, height, puzzle type, solution state, scrambled checksum, file
+# version, the two unknown header fields, and the number of clues
+RECORD = struct.Struct('<BBHHH4s2s12sH')
+FIELD = struct.Struct('<I')
+
+# A record is its RECORD header, a table of field offsets (relative to
+# the start of the record, with one more at the end), then the fields:
+# these, in order, followed by one per clue. ORDER is the codes of the
+# puzzle's extensions as they appeared in its file, including the markup
+# and timer, which have fields of their own; PREAMBLE and POSTSCRIPT are
+# whatever came before and after the puzzle in the file.
+NAME, SOLUTION, FILL, MARKUP, TIMER, TITLE, AUTHOR, COPYRIGHT, NOTES, \
+    EXTENSIONS, ORDER, PREAMBLE, POSTSCRIPT = range(13)
+CLUES = 13
+
+# The timer extension is kept in a slot of this size, padded with NULs,
+# so that progress can be saved back into the pack in place.
+TIMER_SIZE = 16
+
+# code, length; then the data
+EXTENSION = struct.Struct('<4sH')
+
+SEPARATOR = '#'
+
+
+def split_member(path):
+    """Return (archive, id) for a path like 'archive.pack#id', or None."""
+    archive, separator, key = path.rpartition(SEPARATOR)
+    if not separator or not key or os.path.exists(path):
+        return None
+    if not os.path.isfile(archive):
+        return None
+    return archive, key
+
+
+def is_member(path):
+    return split_member(path) is not None
+
+
+def as_bytes(text):
+    if isinstance(text, str):
+        return text.encode(puz.ENCODING)
+    return bytes(text)
+
+
+def encode(name, puzfile):
+    """Return the packed record for a puzzle."""
+    size = puzfile.width * puzfile.height
+    extensions = dict(puzfile.extensions)
+    markup = extensions.pop(puz.Extensions.Markup, b'') or bytes(size)
+    timer = extensions.pop(puz.Extensions.Timer, b'')
+    if len(markup) != size:
+        raise ValueError("markup doesn't match the grid")
+    if len(timer) > TIMER_SIZE:
+        raise ValueError("timer is too long")
+
+    fields = [name, puzfile.solution, puzfile.fill]
+    fields = [text.encode(puz.ENCODING) for text in fields]
+    fields += [markup, timer.ljust(TIMER_SIZE, b'\0')]
+    fields += [text.encode(puz.ENCODING) for text in
+               (puzfile.title, puzfile.author, puzfile.copyright,
+                puzfile.notes)]
+    fields.append(b''.join(EXTENSION.pack(code, len(data)) + data
+                           for code, data in extensions.items()))
+    fields.append(b''.join(code for code in puzfile.extensions
+                           if puzfile.extensions[code]))
+    fields += [as_bytes(puzfile.preamble), as_bytes(puzfile.postscript)]
+    fields += [clue.encode(puz.ENCODING) for clue in puzfile.clues]
+
+    header = RECORD.pack(puzfile.width, puzfile.height, puzfile.puzzletype,
+                         puzfile.solution_state, puzfile.scrambled_cksum,
+                         puzfile.fileversion, puzfile.unk1, puzfile.unk2,
+                         len(puzfile.clues))
+    offset = len(header) + FIELD.size * (len(fields) + 1)
+    offsets = []
+    for field in fields:
+        offsets.append(offset)
+        offset += len(field)
+    offsets.append(offset)
+    return header + b''.join(map(FIELD.pack, offsets)) + b''.join(fields)
+
+
+class Entry:
+    """One puzzle in an archive, read from the map as it's needed."""
+    def __init__(self, data, offset, puzzle_id):
+        self.data = data
+        self.offset = offset
+        self.id = puzzle_id
+        (self.width, self.height, self.puzzletype, self.solution_state,
+         self.scrambled_cksum, self.fileversion, self.unk1, self.unk2,
+         self.clue_count) = RECORD.unpack_from(data, offset)
+
+    def span(self, field):
+        start = self.offset + RECORD.size + FIELD.size * field
+        begin, end = struct.unpack_from('<II', self.data, start)
+        return self.offset + begin, self.offset + end
+
+    def field(self, field):
+        begin, end = self.span(field)
+        return self.data[begin:end]
+
+    def text(self, field):
+        return self.field(field).decode(puz.ENCODING)
+
+    @property
+    def name(self):
+        return self.text(NAME)
+
+    @property
+    def title(self):
+        return self.text(TITLE)
+
+    def clue(self, n):
+        return self.text(CLUES + n)
+
+    def extensions(self):
+        data = self.field(EXTENSIONS)
+        position = 0
+        while position < len(data):
+            code, length = EXTENSION.unpack_from(data, position)
+            position += EXTENSION.size
+            yield code, data[position:position + length]
+            position += length
+
+    def to_puzzle(self):
+        """Return the entry as a puz.Puzzle, ready to solve or save."""
+        puzfile = puz.Puzzle()
+        puzfile.width, puzfile.height = self.width, self.height
+        puzfile.puzzletype = self.puzzletype
+        puzfile.solution_state = self.solution_state
+        puzfile.scrambled_cksum = self.scrambled_cksum
+        puzfile.fileversion = self.fileversion
+        puzfile.version = self.fileversion[:3]
+        puzfile.unk1, puzfile.unk2 = self.unk1, self.unk2
+
+        puzfile.solution = self.text(SOLUTION)
+        puzfile.fill = self.text(FILL)
+        puzfile.title = self.title
+        puzfile.author = self.text(AUTHOR)
+        puzfile.copyright = self.text(COPYRIGHT)
+        puzfile.notes = self.text(NOTES)
+        puzfile.clues = [self.clue(n) for n in range(self.clue_count)]
+
+        puzfile.preamble = self.field(PREAMBLE)
+        puzfile.postscript = self.field(POSTSCRIPT)
+
+        extensions = dict(self.extensions())
+        markup = self.field(MARKUP)
+        order = self.field(ORDER)
+        order = [order[i:i + 4] for i in range(0, len(order), 4)]
+        # Markup added since the puzzle was packed goes after the rest.
+        if puz.Extensions.Markup in order or any(markup):
+            extensions[puz.Extensions.Markup] = markup
+        timer = self.field(TIMER).rstrip(b'\0')
+        if timer:
+            extensions[puz.Extensions.Timer] = timer
+        for code in order + list(extensions):
+            if code in extensions and code not in puzfile.extensions:
+                puzfile.extensions[code] = extensions[code]
+        puzfile._extensions_order = list(puzfile.extensions)
+        return puzfile
+
+    def save(self, puzfile):
+        """Write a puzzle's fill, markup and timer over the entry's."""
+        if (puzfile.width, puzfile.height) != (self.width, self.height):
+            raise ValueError("the puzzle doesn't fit this entry")
+        size = self.width * self.height
+        markup = (bytes(puzfile.markup().markup) if puzfile.has_markup()
+                  else bytes(size))
+        timer = puzfile.extensions.get(puz.Extensions.Timer, b'')
+        if len(timer) > TIMER_SIZE:
+            raise ValueError("timer is too long")
+
+        for field, value in ((FILL, puzfile.fill.encode(puz.ENCODING)),
+                             (MARKUP, markup),
+                             (TIMER, timer.ljust(TIMER_SIZE, b'\0'))):
+            begin, end = self.span(field)
+            self.data[begin:end] = value
+
+
+class Archive:
+    """A pack of puzzles, memory-mapped.
+
+    Opening an archive reads only its header. Looking up a puzzle by id
+    reads one index entry; by name, a binary search of the name index.
+    """
+    def __init__(self, path, writable=False):
+        self.path = path
+        with open(path, 'r+b' if writable else 'rb') as f:
+            self.data = mmap.mmap(
+                    f.fileno(), 0,
+                    access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        if len(self.data) < HEADER.size:
+            magic = None
+        else:
+            magic, self.count, self.index, self.names = \
+                HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("{} is not a puzzle pack".format(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.close()
+
+    def entry(self, puzzle_id):
+        if not 0 <= puzzle_id < self.count:
+            raise KeyError(puzzle_id)
+        offset, = OFFSET.unpack_from(
+                self.data, self.index + OFFSET.size * puzzle_id)
+        return Entry(self.data, offset, puzzle_id)
+
+    def named(self, n):
+        puzzle_id, = ID.unpack_from(self.data, self.names + ID.size * n)
+        return puzzle_id
+
+    def find(self, key):
+        """Return the entry named key or, failing that, with id key.
+
+        A name is looked up first, so a puzzle whose name is a number
+        can still be found by it.
+        """
+        try:
+            return self.find_name(key)
+        except KeyError:
+            if key.isdigit():
+                return self.entry(int(key))
+            raise
+
+    def find_name(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(self.named(middle)).name < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            entry = self.entry(self.named(low))
+            if entry.name == key:
+                return entry
+        raise KeyError(key)
+
+    def __iter__(self):
+        return map(self.entry, range(self.count))
+
+
+def read_member(path):
+    """Read the puzzle at 'archive.pack#id' (or #name)."""
+    archive_path, key = split_member(path)
+    with Archive(archive_path) as archive:
+        return archive.find(key).to_puzzle()
+
+
+def write_member(path, puzfile):
+    """Save a puzzle's progress back into 'archive.pack#id'."""
+    archive_path, key = split_member(path)
+    with Archive(archive_path, writable=True) as archive:
+        archive.find(key).save(puzfile)
+        archive.data.flush()
+
+
+def puzzle_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def encode_file(path):
+    """Read and pack one puzzle; return (path, record, error message)."""
+    try:
+        return path, encode(puzzle_name(path), puz.read(path)), None
+    except (OSError, ValueError, puz.PuzzleFormatError) as e:
+        return path, None, str(getattr(e, 'message', e)) or "unreadable"
+
+
+def write_archive(path, records):
+    """Write records (name, bytes) to a new pack; return how many."""
+    offsets = []
+    names = []
+    with open(path, 'wb') as f:
+        f.write(bytes(HEADER.size))
+        for name, record in records:
+            offsets.append(f.tell())
+            names.append(name)
+            f.write(record)
+
+        index = f.tell()
+        f.write(b''.join(map(OFFSET.pack, offsets)))
+        name_index = f.tell()
+        f.write(b''.join(ID.pack(puzzle_id) for puzzle_id in
+                         sorted(range(len(names)), key=names.__getitem__)))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(offsets), index, name_index))
+    return len(offsets)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            prog='cursewords pack',
+            description="""Packs many .puz files into one archive, whose
+                           puzzles can be opened with
+                           `cursewords ARCHIVE#ID`.""")
+    parser.add_argument('archive', metavar='ARCHIVE',
+            help="""path of the archive to write""")
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+            help="""puzzle files, or directories to search for them""")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help="""number of worker processes (default: one per CPU)""")
+
+    args = parser.parse_args(argv)
+    failed = 0
+
+    def records(results):
+        nonlocal failed
+        for path, record, error in results:
+            if error:
+                failed += 1
+                print("{}: {}".format(path, error), file=sys.stderr)
+            else:
+                yield puzzle_name(path), record
+
+    with multiprocessing.Pool(args.jobs) as pool:
+        packed = write_archive(args.archive, records(pool.imap(
+                encode_file, find_puzzles(args.paths), chunksize=64)))
+
+    print("{} packed, {} failed.".format(packed, failed), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def unpack_main(argv=None):
+    parser = argparse.ArgumentParser(
+            prog='cursewords unpack',
+            description="""Lists the puzzles in an archive, or writes them
+                           out as .puz files.""")
+    parser.add_argument('archive', metavar='ARCHIVE',
+            help="""archive written by `cursewords pack`""")
+    parser.add_argument('keys', metavar='ID', nargs='*',
+            help="""ids or names of the puzzles to unpack (default: all)""")
+    parser.add_argument('-o', '--output', metavar='DIR', default='.',
+            help="""directory for the .puz files (default: the current
+                    directory)""")
+    parser.add_argument('-l', '--list', action='store_true',
+            help="""list each puzzle's id, name and title instead""")
+
+    args = parser.parse_args(argv)
+    try:
+        archive = Archive(args.archive)
+    except (OSError, ValueError) as e:
+        parser.exit(1, "Unable to open {}: {}\n".format(args.archive, e))
+
+    with archive:
+        if args.keys:
+            try:
+                entries = [archive.find(key) for key in args.keys]
+            except KeyError as e:
+                parser.exit(1, "No puzzle {} in {}.\n".format(
+                    e.args[0], args.archive))
+        else:
+            entries = list(archive)
+
+        if args.list:
+            for entry in entries:
+                print("{}\t{}\t{}".format(entry.id, entry.name,
+                                          entry.title))
+            return 0
+
+        os.makedirs(args.output, exist_ok=True)
+        for entry in entries:
+            path = os.path.join(args.output, entry.name + '.puz')
+            entry.to_puzzle().save(path)
+            print(path)
+    return 0
@@ -0,0 +1,128 @@
+import bisect
+import json
+
+VERSION = 1
+
+# A full snapshot of the grid is written after this many changed cells,
+# so seeking never has to apply more than this many changes.
+KEYFRAME_INTERVAL = 200
+
+
+class Recorder:
+    """Appends a solve's cell changes, timed by its Timer, to a file.
+
+    The file is JSON lines: a header, then keyframes ({"t", "k", "m"},
+    holding every cell's entry and markup) and deltas ({"t", "c"}, a list
+    of [index, entry, markup]). Each session starts with a keyframe, so
+    recording into an existing file carries on where it left off.
+    """
+    def __init__(self, path, grid, timer):
+        self.grid = grid
+        self.timer = timer
+        self.since_keyframe = 0
+
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+        if self.file.tell() == 0:
+            self.write({'v': VERSION, 'width': grid.column_count,
+                        'height': grid.row_count})
+        self.keyframe()
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def keyframe(self):
+        cells = list(self.grid.cells.values())
+        self.write({'t': round(self.timer.elapsed(), 2),
+                    'k': ''.join(cell.entry for cell in cells),
+                    'm': [cell.get_markup() for cell in cells]})
+        self.since_keyframe = 0
+
+    def cells_changed(self, changes, origin):
+        self.write({'t': round(self.timer.elapsed(), 2),
+                    'c': [[change.index, change.entry, change.markup]
+                          for change in changes]})
+        self.since_keyframe += len(changes)
+        if self.since_keyframe >= KEYFRAME_INTERVAL:
+            self.keyframe()
+
+    def close(self):
+        self.file.close()
+
+
+class Recording:
+    """A recorded solve, loaded for replay."""
+    def __init__(self, path):
+        self.times = []
+        self.events = []
+        self.keyframes = []
+
+        with open(path, encoding='utf-8') as f:
+            try:
+                header = json.loads(f.readline())
+                if header.get('v') != VERSION:
+                    raise ValueError
+                self.width, self.height = header['width'], header['height']
+            except (ValueError, KeyError, AttributeError):
+                raise ValueError("not a cursewords recording")
+
+            last_time = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    # A reset or an unsaved session can send the timer
+                    # backwards; keep the timeline in order.
+                    last_time = max(last_time, float(record['t']))
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if 'k' in record:
+                    self.keyframes.append(len(self.events))
+                    event = (list(record['k']), list(record['m']))
+                elif 'c' in record:
+                    event = record['c']
+                else:
+                    continue
+                self.times.append(last_time)
+                self.events.append(event)
+
+        # Drop anything before the first keyframe, which has nothing to
+        # apply its changes to.
+        if not self.keyframes:
+            raise ValueError("recording has no keyframes")
+        start = self.keyframes[0]
+        self.times = self.times[start:]
+        self.events = self.events[start:]
+        self.keyframes = [k - start for k in self.keyframes]
+        self.keyframe_set = set(self.keyframes)
+
+    @property
+    def duration(self):
+        return self.times[-1]
+
+    def index_at(self, seconds):
+        """Return the index of the first event after a time."""
+        return bisect.bisect_right(self.times, seconds)
+
+    def apply(self, state, event_index):
+        event = self.events[event_index]
+        entries, markup = state
+        if event_index in self.keyframe_set:
+            entries[:], markup[:] = event
+        else:
+            for idx, entry, md in event:
+                entries[idx] = entry
+                markup[idx] = md
+
+    def state_at(self, seconds):
+        """Return ((entries, markup), next event index) at a time.
+
+        Starts from the last keyframe at or before that time, so the
+        cost doesn't depend on how far into the solve it is.
+        """
+        end = max(self.index_at(seconds), 1)
+        keyframe = self.keyframes[
+                bisect.bisect_right(self.keyframes, end - 1) - 1]
+        entries, markup = self.events[keyframe]
+        state = (list(entries), list(markup))
+        for i in range(keyframe + 1, end):
+            self.apply(state, i)
+        return state, end
@@ -0,0 +1,256 @@
+import argparse
+import bisect
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+
+import puz
+
+from .checksums import find_puzzles
+from .wordlist import cache_dir
+
+TOKEN = re.compile(r"[^\W_]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    size INTEGER,
+    mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS clues (
+    file INTEGER,
+    n INTEGER,
+    number INTEGER,
+    direction TEXT,
+    text TEXT,
+    PRIMARY KEY (file, n)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT,
+    file INTEGER,
+    n INTEGER,
+    PRIMARY KEY (token, file, n)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_file ON postings (file);
+"""
+
+# Below this many new or changed files, parsing them in-process is
+# quicker than starting a pool.
+POOL_THRESHOLD = 32
+
+
+def tokens(text):
+    return TOKEN.findall(text.lower())
+
+
+def prefix_range(term):
+    """Return (low, high) bounds covering every string starting with term."""
+    return term, term[:-1] + chr(ord(term[-1]) + 1)
+
+
+def library_path():
+    return os.path.join(cache_dir(), 'library.sqlite3')
+
+
+def read_clues(path):
+    try:
+        puzfile = puz.read(path)
+        numbering = puzfile.clue_numbering()
+    except Exception:
+        return path, None
+    return path, ([(clue['num'], 'A', clue['clue'])
+                   for clue in numbering.across] +
+                  [(clue['num'], 'D', clue['clue'])
+                   for clue in numbering.down])
+
+
+class ClueIndex:
+    """An in-memory inverted index over one puzzle's clues.
+
+    Every term of a query must match the start of some word in a clue.
+    The vocabulary is kept sorted so each term's matching words are a
+    contiguous run found by bisection.
+    """
+    def __init__(self, clues):
+        self.postings = {}
+        for i, text in enumerate(clues):
+            for token in tokens(text):
+                self.postings.setdefault(token, set()).add(i)
+        self.vocabulary = sorted(self.postings)
+
+    def search(self, query):
+        """Return the indexes of the clues matching query, in order."""
+        result = None
+        for term in tokens(query):
+            found = set()
+            start = bisect.bisect_left(self.vocabulary, term)
+            for token in self.vocabulary[start:]:
+                if not token.startswith(term):
+                    break
+                found |= self.postings[token]
+            result = found if result is None else result & found
+            if not result:
+                return []
+        return sorted(result or [])
+
+
+class Library:
+    """A persistent clue index over a collection of .puz files.
+
+    Files are tracked by size and modification time; update() re-reads
+    only the files that changed and drops the ones that disappeared.
+    """
+    def __init__(self, path=None):
+        path = path or library_path()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, roots, jobs=None):
+        """Index new and changed files under roots; return (read, removed)."""
+        known = {path: (file_id, size, mtime) for file_id, path, size, mtime
+                 in self.db.execute("SELECT id, path, size, mtime FROM files")}
+        prefixes = tuple(os.path.join(os.path.abspath(root), '')
+                         for root in roots)
+
+        seen = set()
+        changed = []
+        for path in find_puzzles(roots):
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            seen.add(path)
+            if known.get(path, (None,))[1:] != (stat.st_size,
+                                                stat.st_mtime_ns):
+                changed.append((path, stat))
+
+        removed = [path for path in known
+                   if path.startswith(prefixes) and path not in seen]
+
+        with self.db:
+            for path in removed:
+                self.forget(known[path][0])
+                self.db.execute("DELETE FROM files WHERE id = ?",
+                                (known[path][0],))
+
+            stats = dict(changed)
+            paths = list(stats)
+            if len(paths) < POOL_THRESHOLD:
+                results = map(read_clues, paths)
+                self.store_all(results, stats, known)
+            else:
+                with multiprocessing.Pool(jobs) as pool:
+                    results = pool.imap_unordered(read_clues, paths,
+                                                  chunksize=16)
+                    self.store_all(results, stats, known)
+
+        return len(changed), len(removed)
+
+    def store_all(self, results, stats, known):
+        for path, clues in results:
+            self.store(path, stats[path], clues, known.get(path, (None,))[0])
+
+    def forget(self, file_id):
+        self.db.execute("DELETE FROM clues WHERE file = ?", (file_id,))
+        self.db.execute("DELETE FROM postings WHERE file = ?", (file_id,))
+
+    def store(self, path, stat, clues, file_id=None):
+        if file_id is None:
+            file_id = self.db.execute(
+                    "INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime_ns)).lastrowid
+        else:
+            self.forget(file_id)
+            self.db.execute("UPDATE files SET size = ?, mtime = ? "
+                            "WHERE id = ?",
+                            (stat.st_size, stat.st_mtime_ns, file_id))
+
+        # Unreadable files stay in the table without clues, so they aren't
+        # re-read until they change.
+        if not clues:
+            return
+
+        self.db.executemany(
+                "INSERT INTO clues VALUES (?, ?, ?, ?, ?)",
+                ((file_id, n, number, direction, text)
+                 for n, (number, direction, text) in enumerate(clues)))
+        self.db.executemany(
+                "INSERT OR IGNORE INTO postings VALUES (?, ?, ?)",
+                ((token, file_id, n)
+                 for n, (_, _, text) in enumerate(clues)
+                 for token in tokens(text)))
+
+    def search(self, query, roots=None, limit=None):
+        """Return (path, number, direction, text) for each matching clue."""
+        terms = tokens(query)
+        if not terms:
+            return []
+
+        selects = ' INTERSECT '.join(
+                ["SELECT file, n FROM postings WHERE token >= ? AND token < ?"]
+                * len(terms))
+        args = [bound for term in terms for bound in prefix_range(term)]
+
+        where = ''
+        if roots:
+            prefixes = [os.path.join(os.path.abspath(root), '')
+                        for root in roots]
+            where = "WHERE " + " OR ".join(
+                    ["(files.path >= ? AND files.path < ?)"] * len(prefixes))
+            args += [bound for prefix in prefixes
+                     for bound in prefix_range(prefix)]
+
+        query = ("SELECT files.path, clues.number, clues.direction, clues.text "
+                 "FROM ({}) AS hits "
+                 "JOIN clues ON clues.file = hits.file AND clues.n = hits.n "
+                 "JOIN files ON files.id = hits.file {} "
+                 "ORDER BY files.path, clues.n".format(selects, where))
+        if limit:
+            query += " LIMIT ?"
+            args.append(limit)
+
+        return self.db.execute(query, args).fetchall()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            prog='cursewords search',
+            description="""Searches the clues of every puzzle in a
+                           directory. Each word of the query matches the
+                           start of a word in the clue.""")
+    parser.add_argument('query', metavar='WORD', nargs='+',
+            help="""words to look for""")
+    parser.add_argument('-d', '--dir', dest='dirs', metavar='DIR',
+            action='append',
+            help="""directory of puzzles to search, which may be given
+                    more than once (default: the current directory)""")
+    parser.add_argument('-n', '--limit', type=int, default=None,
+            help="""show at most this many clues""")
+
+    args = parser.parse_args(argv)
+    dirs = args.dirs or ['.']
+
+    library = Library()
+    try:
+        library.update(dirs)
+        results = library.search(' '.join(args.query), roots=dirs,
+                                 limit=args.limit)
+    finally:
+        library.close()
+
+    cwd = os.getcwd()
+    for path, number, direction, text in results:
+        print("{}: {}{} {}".format(os.path.relpath(path, cwd), number,
+                                   direction, text))
+
+    if not results:
+        print("No clues found.", file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,244 @@
+import collections
+
+from .wordlist import ALPHABET, LETTER_INDEX
+
+# Domains are bitmasks over ALPHABET: bit i set means ALPHABET[i] is
+# still a possible letter for that square.
+FULL = (1 << len(ALPHABET)) - 1
+
+
+def letters(domain):
+    return [ALPHABET[i] for i in range(len(ALPHABET)) if domain >> i & 1]
+
+
+class Propagator:
+    """Narrows every square's possible letters using the crossings.
+
+    Each word keeps a bitset of the dictionary words (of its length) that
+    still fit, and each square a bitset of the letters still possible.
+    Revising a word drops candidates that disagree with its squares'
+    domains, then drops letters no remaining candidate supports; any
+    square that shrinks queues the words crossing it.
+
+    Words are taken in order, and one that would leave some word with no
+    candidates is set aside and reported rather than allowed to wipe out
+    its crossings.
+
+    Entering a letter only removes possibilities, so update() re-revises
+    just the words through that square and whatever they disturb.
+    Clearing or changing a letter can add possibilities back, which the
+    cached sets can't express, so the squares that may have been narrowed
+    because of it go back to their entries and only the words through
+    them are revised again. A word that runs out of candidates along the
+    way is set aside and undone the same way; if that can't be shown to
+    match what taking the words in order would set aside, it starts over.
+    """
+    def __init__(self, grid, index):
+        self.grid = grid
+        self.index = index
+        self.bitsets = {}
+
+        self.words = []
+        self.directions = []
+        for direction, group in (('A', grid.across_words),
+                                 ('D', grid.down_words)):
+            for word in group:
+                if len(word) in index.lengths:
+                    self.words.append(word)
+                    self.directions.append(direction)
+
+        self.cell_words = {}
+        for w, word in enumerate(self.words):
+            for pos in word:
+                self.cell_words.setdefault(pos, []).append(w)
+
+        self.reset()
+
+    def bitset(self, length, pos, letter):
+        key = (length, pos, letter)
+        if key not in self.bitsets:
+            self.bitsets[key] = self.index.bitset(length, pos, letter)
+        return self.bitsets[key]
+
+    def root_domain(self, pos):
+        cell = self.grid.cells.get(pos)
+        if cell.is_blankish() or cell.entry not in LETTER_INDEX:
+            return FULL
+        return 1 << LETTER_INDEX[cell.entry]
+
+    def all_candidates(self, w):
+        return (1 << self.index.lengths[len(self.words[w])][0]) - 1
+
+    def reset(self):
+        self.roots = {pos: self.root_domain(pos) for pos in self.cell_words}
+        self.domains = dict(self.roots)
+        self.candidates = [self.all_candidates(w)
+                           for w in range(len(self.words))]
+        self.contradictions = set(range(len(self.words)))
+        for w in range(len(self.words)):
+            domains, candidates = dict(self.domains), list(self.candidates)
+            self.contradictions.discard(w)
+            if not self.propagate([w], strict=True):
+                self.domains, self.candidates = domains, candidates
+                self.contradictions.add(w)
+
+    def update(self, pos):
+        if pos not in self.cell_words:
+            return
+
+        old_root, new_root = self.roots[pos], self.root_domain(pos)
+        if old_root == new_root:
+            return
+
+        self.roots[pos] = new_root
+        if new_root & ~self.domains[pos]:
+            words = self.widen([pos])
+        else:
+            self.domains[pos] = new_root
+            words = set(self.cell_words[pos])
+        # Set-aside words get another try, having narrowed nothing yet.
+        idle = words & self.contradictions
+        self.contradictions -= idle
+        self.propagate(words, idle)
+
+        if not all(self.clashes(w) for w in self.contradictions):
+            self.reset()
+
+    def widen(self, positions):
+        """Put squares back to their entries, with any they narrowed."""
+        # A square can only have been narrowed because of these through
+        # a word they share, so the search stops at squares that are
+        # still at their entries.
+        region = set(positions)
+        stack = list(positions)
+        while stack:
+            for w in self.cell_words[stack.pop()]:
+                for pos in self.words[w]:
+                    if (pos not in region
+                            and self.domains[pos] != self.roots[pos]):
+                        region.add(pos)
+                        stack.append(pos)
+
+        words = set()
+        for pos in region:
+            self.domains[pos] = self.roots[pos]
+            words.update(self.cell_words[pos])
+        for w in words:
+            self.candidates[w] = self.all_candidates(w)
+        return words
+
+    def clashes(self, w):
+        # Whether w fits nothing alongside the words before it, judged
+        # only by its own entries and the entries of earlier words
+        # crossing it. That is enough to be sure it would have been set
+        # aside; anything subtler isn't worth proving here.
+        word = self.words[w]
+        candidates = self.all_candidates(w)
+        for i, pos in enumerate(word):
+            domain = self.roots[pos]
+            for other in self.cell_words[pos]:
+                if other < w and other not in self.contradictions:
+                    domain &= self.entry_support(other, pos)
+            candidates &= self.allowed(len(word), i, domain)
+        return not candidates
+
+    def entry_support(self, w, pos):
+        # The letters at pos in the words fitting w's entries.
+        word = self.words[w]
+        candidates = self.all_candidates(w)
+        for i, square in enumerate(word):
+            candidates &= self.allowed(len(word), i, self.roots[square])
+        i = word.index(pos)
+        supported = 0
+        for letter in ALPHABET:
+            if candidates & self.bitset(len(word), i, letter):
+                supported |= 1 << LETTER_INDEX[letter]
+        return supported
+
+    def allowed(self, length, i, domain):
+        if domain == FULL:
+            return (1 << self.index.lengths[length][0]) - 1
+        allowed = 0
+        for letter in letters(domain):
+            allowed |= self.bitset(length, i, letter)
+        return allowed
+
+    def cells_changed(self, changes, origin):
+        for change in changes:
+            self.update(change.position)
+
+    def propagate(self, words, idle=(), strict=False):
+        # Words in idle haven't narrowed anything yet, so there is
+        # nothing to undo if they turn out to have no candidates. With
+        # strict, any word running out stops propagation instead.
+        idle = set(idle)
+        queue = collections.deque(sorted(words))
+        queued = set(queue)
+        while queue:
+            w = queue.popleft()
+            queued.discard(w)
+            if w in self.contradictions:
+                continue
+            shrunk = self.revise(w)
+            if shrunk is None:
+                if strict:
+                    return False
+                self.contradictions.add(w)
+                if w not in idle:
+                    requeue = self.widen(self.words[w])
+                    queue.extend(sorted(requeue - queued))
+                    queued |= requeue
+                continue
+            if shrunk:
+                idle.discard(w)
+            for pos in shrunk:
+                for other in self.cell_words[pos]:
+                    if other != w and other not in queued:
+                        queue.append(other)
+                        queued.add(other)
+        return True
+
+    def revise(self, w):
+        word = self.words[w]
+        length = len(word)
+
+        candidates = self.candidates[w]
+        for i, pos in enumerate(word):
+            domain = self.domains[pos]
+            if domain != FULL:
+                candidates &= self.allowed(length, i, domain)
+        self.candidates[w] = candidates
+
+        # Don't let a word with no candidates wipe out its crossings;
+        # it's reported instead.
+        if not candidates:
+            return None
+
+        shrunk = []
+        for i, pos in enumerate(word):
+            domain = self.domains[pos]
+            supported = 0
+            for letter in letters(domain):
+                if candidates & self.bitset(length, i, letter):
+                    supported |= 1 << LETTER_INDEX[letter]
+            if supported != domain:
+                self.domains[pos] = supported
+                shrunk.append(pos)
+        return shrunk
+
+    def forced(self):
+        """Return (position, letter) for blank squares with one option."""
+        forced = []
+        for pos, domain in self.domains.items():
+            if (domain and not domain & (domain - 1)
+                    and self.grid.cells.get(pos).is_blankish()):
+                forced.append((pos, letters(domain)[0]))
+        return sorted(forced, key=lambda item: (item[0][1], item[0][0]))
+
+    def contradicted_words(self):
+        """Return labels like '12A' for words nothing in the list fits."""
+        labels = []
+        for w in sorted(self.contradictions):
+            number = self.grid.cells.get(self.words[w][0]).number
+            labels.append('{}{}'.format(number, self.directions[w]))
+        return labels
@@ -0,0 +1,134 @@
+import math
+import multiprocessing
+import os
+import string
+
+import puz
+
+from .checksums import data_cksums
+
+KEYS = range(10000)
+
+# Keys are tried in this many chunks, spread across a pool when there's
+# more than one CPU to run it on.
+CHUNKS = 8
+
+# Log frequencies of letters in English text.
+LETTER_FREQUENCY = {letter: math.log(frequency) for letter, frequency in zip(
+    string.ascii_uppercase,
+    [8.2, 1.5, 2.8, 4.3, 12.7, 2.2, 2.0, 6.1, 7.0, 0.15, 0.77, 4.0, 2.4,
+     6.7, 7.5, 1.9, 0.095, 6.0, 6.3, 9.1, 2.8, 0.98, 2.4, 0.15, 2.0, 0.074])}
+
+UPPER = string.ascii_uppercase.encode()
+
+# UNSHIFT[d] moves every capital letter d places back through the alphabet.
+UNSHIFT = [bytes.maketrans(UPPER, UPPER[-d:] + UPPER[:-d] if d else UPPER)
+           for d in range(10)]
+
+
+def key_digits(key):
+    return [int(c) for c in str(key).zfill(4)]
+
+
+def unscramble(data, key):
+    """Undo puz.scramble_string on bytes.
+
+    The same steps as puzpy's unscramble_string, but each one is a few
+    slices and translations rather than a loop over the letters.
+    """
+    digits = key_digits(key)
+    length = len(data)
+    for k in reversed(digits):
+        data = data[1::2] + data[::2]
+        data = data[length - k:] + data[:length - k]
+        shifted = bytearray(data)
+        for phase, d in enumerate(digits):
+            shifted[phase::4] = data[phase::4].translate(UNSHIFT[d])
+        data = bytes(shifted)
+    return data
+
+
+def scrambled_letters(puzfile):
+    """Return the letters of a puzzle's solution, column by column."""
+    columns = puz.square(puzfile.solution, puzfile.width, puzfile.height)
+    return columns.replace(puz.BLACKSQUARE, '').encode(puz.ENCODING)
+
+
+def search_keys(letters, cksum, keys):
+    """Return the keys whose unscrambled letters have the right checksum."""
+    data = b''.join(unscramble(letters, key) for key in keys)
+    return [key for key, value in zip(keys, data_cksums(data, len(letters)))
+            if value == cksum]
+
+
+def search_chunk(args):
+    return search_keys(*args)
+
+
+def likelihood(puzfile, key):
+    # The checksum is only 16 bits, so a few wrong keys out of 10,000
+    # can match it too. Prefer the solution that agrees with more of the
+    # letters already filled in, then the one that reads more like English.
+    solution = puz.unscramble_solution(puzfile.solution, puzfile.width,
+                                       puzfile.height, key)
+    agreed = sum(1 for letter, entry in zip(solution, puzfile.fill)
+                 if letter == entry)
+    return agreed, sum(LETTER_FREQUENCY.get(letter, 0)
+                       for letter in solution)
+
+
+def find_key(puzfile, jobs=None):
+    """Return the key that unlocks a scrambled puzzle, or None."""
+    letters = scrambled_letters(puzfile)
+    if not letters:
+        return None
+
+    size = -(-len(KEYS) // CHUNKS)
+    chunks = [(letters, puzfile.scrambled_cksum, KEYS[i:i + size])
+              for i in range(0, len(KEYS), size)]
+
+    if (jobs or os.cpu_count() or 1) == 1:
+        results = list(map(search_chunk, chunks))
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(search_chunk, chunks)
+
+    candidates = [key for keys in results for key in keys]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda key: likelihood(puzfile, key))
+
+
+def key_path(path):
+    return path + '.key'
+
+
+def unlock(puzfile, path=None):
+    """Unlock a scrambled puzzle in place; return its key, or None.
+
+    A key found by searching is saved next to the puzzle file, and tried
+    first the next time it's opened.
+    """
+    if not puzfile.is_solution_locked():
+        return None
+
+    if path:
+        try:
+            with open(key_path(path)) as f:
+                key = int(f.read())
+            if puzfile.unlock_solution(key):
+                return key
+        except (OSError, ValueError):
+            pass
+
+    key = find_key(puzfile)
+    if key is None or not puzfile.unlock_solution(key):
+        return None
+
+    if path:
+        try:
+            with open(key_path(path), 'w') as f:
+                f.write('{:04d}\n'.format(key))
+        except OSError:
+            pass
+    return key
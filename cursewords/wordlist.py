@@ -0,0 +1,181 @@
+import hashlib
+import mmap
+import os
+import string
+import struct
+
+ALPHABET = string.ascii_uppercase + string.digits
+LETTER_INDEX = {letter: i for i, letter in enumerate(ALPHABET)}
+
+MAGIC = b'CWWL'
+VERSION = 1
+
+# magic, version, source size, source mtime, number of lengths
+HEADER_FORMAT = '<4sIQQI'
+# word length, word count, offset of words, offset of bitsets, bitset size
+LENGTH_FORMAT = '<IIQQI'
+
+DEFAULT_WORDLISTS = [
+    os.path.expanduser('~/.config/cursewords/wordlist.txt'),
+    '/usr/share/dict/words',
+]
+
+
+def cache_dir():
+    base = (os.environ.get('XDG_CACHE_HOME')
+            or os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'cursewords')
+
+
+def default_wordlist():
+    return next((path for path in DEFAULT_WORDLISTS
+                 if os.path.isfile(path)), None)
+
+
+def index_path(wordlist_path):
+    # Indexes live in the cache rather than next to the list, which may be
+    # a read-only system file like /usr/share/dict/words.
+    path = os.path.abspath(wordlist_path)
+    digest = hashlib.sha1(path.encode()).hexdigest()[:16]
+    name = '{}-{}.idx'.format(os.path.basename(path), digest)
+    return os.path.join(cache_dir(), name)
+
+
+def normalize(line):
+    # Lists in the common "WORD;SCORE" format keep only the word.
+    word = line.split(';', 1)[0].upper()
+    word = ''.join(c for c in word if c not in ' -\'.')
+    if word and all(c in LETTER_INDEX for c in word):
+        return word
+    return None
+
+
+def build(wordlist_path, out_path):
+    stat = os.stat(wordlist_path)
+
+    by_length = {}
+    with open(wordlist_path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            word = normalize(line.strip())
+            if word and len(word) > 1:
+                by_length.setdefault(len(word), set()).add(word)
+
+    lengths = sorted(by_length)
+    offset = (struct.calcsize(HEADER_FORMAT)
+              + len(lengths) * struct.calcsize(LENGTH_FORMAT))
+
+    table = []
+    chunks = []
+    for length in lengths:
+        words = sorted(by_length[length])
+        count = len(words)
+        nbytes = (count + 7) // 8
+
+        words_offset = offset
+        words_blob = ''.join(words).encode('ascii')
+        offset += len(words_blob)
+
+        # One bitset per (position, letter): bit i is set when word i
+        # has that letter in that position.
+        bitsets = bytearray(length * len(ALPHABET) * nbytes)
+        for i, word in enumerate(words):
+            byte, bit = i >> 3, 1 << (i & 7)
+            for pos, letter in enumerate(word):
+                slot = pos * len(ALPHABET) + LETTER_INDEX[letter]
+                bitsets[slot * nbytes + byte] |= bit
+
+        bitsets_offset = offset
+        offset += len(bitsets)
+
+        table.append(struct.pack(LENGTH_FORMAT, length, count,
+                                 words_offset, bitsets_offset, nbytes))
+        chunks += [words_blob, bitsets]
+
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, stat.st_size,
+                            stat.st_mtime_ns, len(lengths)))
+        f.writelines(table)
+        f.writelines(chunks)
+    os.replace(tmp_path, out_path)
+
+
+class WordIndex:
+    """A memory-mapped word list index.
+
+    Words of each length are stored sorted and fixed-width, followed by a
+    bitset for every (position, letter) pair. A pattern lookup ANDs the
+    bitsets of its known letters and reads off the words whose bits
+    survive, so it never looks at non-matching words.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.source_size, self.source_mtime,
+         length_count) = struct.unpack_from(HEADER_FORMAT, self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a cursewords word list index")
+
+        self.lengths = {}
+        offset = struct.calcsize(HEADER_FORMAT)
+        for _ in range(length_count):
+            length, *entry = struct.unpack_from(LENGTH_FORMAT,
+                                                self.data, offset)
+            self.lengths[length] = entry
+            offset += struct.calcsize(LENGTH_FORMAT)
+
+    @classmethod
+    def open(cls, wordlist_path):
+        path = index_path(wordlist_path)
+        stat = os.stat(wordlist_path)
+        try:
+            index = cls(path)
+            if (index.source_size == stat.st_size and
+                    index.source_mtime == stat.st_mtime_ns):
+                return index
+            index.close()
+        except (OSError, ValueError, struct.error):
+            pass
+
+        build(wordlist_path, path)
+        return cls(path)
+
+    def close(self):
+        self.data.close()
+
+    def bitset(self, length, pos, letter):
+        count, words_offset, bitsets_offset, nbytes = self.lengths[length]
+        slot = pos * len(ALPHABET) + LETTER_INDEX[letter]
+        start = bitsets_offset + slot * nbytes
+        return int.from_bytes(self.data[start:start + nbytes], 'little')
+
+    def word(self, length, i):
+        words_offset = self.lengths[length][1]
+        start = words_offset + i * length
+        return self.data[start:start + length].decode('ascii')
+
+    def matches(self, pattern, limit=None):
+        """Return words matching pattern, where '?' or '-' is unknown."""
+        pattern = pattern.upper()
+        length = len(pattern)
+        if length not in self.lengths:
+            return []
+        count = self.lengths[length][0]
+
+        candidates = (1 << count) - 1
+        for pos, letter in enumerate(pattern):
+            if letter in LETTER_INDEX:
+                candidates &= self.bitset(length, pos, letter)
+            elif letter not in '?-':
+                return []
+            if not candidates:
+                return []
+
+        words = []
+        while candidates and (limit is None or len(words) < limit):
+            lowest = candidates & -candidates
+            words.append(self.word(length, lowest.bit_length() - 1))
+            candidates ^= lowest
+        return words
@@ -28,7 +28,7 @@ setup(
         'Topic :: Games/Entertainment :: Puzzle Games',
     ],
     packages=find_packages(),
-    python_requires='>=3.4',
+    python_requires='>=3.7',
     install_requires=reqs,
     package_data={
         'cursewords': ['version']